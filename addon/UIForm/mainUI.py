@@ -153,6 +153,10 @@ class Ui_Dialog(object):
         self.syncTemplatesCheckbox.setChecked(True)
         self.syncTemplatesCheckbox.setObjectName("syncTemplatesCheckbox")
         self.gridLayout.addWidget(self.syncTemplatesCheckbox, 0, 1, 1, 1)
+        self.bypassCacheCheckBox = QtWidgets.QCheckBox(parent=self.defaultConfigGroupBox)
+        self.bypassCacheCheckBox.setChecked(False)
+        self.bypassCacheCheckBox.setObjectName("bypassCacheCheckBox")
+        self.gridLayout.addWidget(self.bypassCacheCheckBox, 0, 2, 1, 1)
         self.gridLayout_2.addWidget(self.defaultConfigGroupBox, 1, 0, 1, 2)
         self.credentialGroupBox = QtWidgets.QGroupBox(parent=self.settingTab)
         self.credentialGroupBox.setObjectName("credentialGroupBox")
@@ -290,6 +294,8 @@ class Ui_Dialog(object):
         self.briefDefinitionCheckBox.setText(_translate("Dialog", "精简释义"))
         self.BrEPronRadioButton.setText(_translate("Dialog", "英式发音"))
         self.syncTemplatesCheckbox.setText(_translate("Dialog", "同步模版"))
+        self.bypassCacheCheckBox.setToolTip(_translate("Dialog", "Ignore cached query results and query the dictionary API again"))
+        self.bypassCacheCheckBox.setText(_translate("Dialog", "跳过缓存"))
         self.credentialGroupBox.setTitle(_translate("Dialog", "账号设置"))
         self.currentDictionaryLabel.setText(_translate("Dialog", "当前选择词典: "))
         self.usernameLabel.setText(_translate("Dialog", "账号"))
@@ -13,20 +13,23 @@ from aqt.qt import pyqtSlot, QThread, Qt
 from . import utils
 from .queryApi import apis
 from .UIForm import wordGroup, mainUI, icons_rc
-from .workers import LoginStateCheckWorker, VersionCheckWorker, RemoteWordFetchingWorker, QueryWorker, AssetDownloadWorker
+from .workers import LoginStateCheckWorker, VersionCheckWorker, RemoteWordFetchingWorker, QueryWorker, AssetDownloadWorker, StreamingSyncWorker
 from .dictionary import dictionaries
 from .logger import TimedBufferingHandler
 from .loginDialog import LoginDialog
-from .misc import Mask, SimpleWord
+from .misc import Mask, SimpleWord, LoginExpired
+from .assetManager import MediaIndex, MediaStore
+from .queryCache import QueryCache
 from .constants import *
 
 try:
     from aqt import mw
     from aqt.utils import askUser, showCritical, showInfo, tooltip, openLink
+    from aqt.operations import CollectionOp
     from .noteManager import *
 except ImportError:
-    from test.dummy_aqt import mw, askUser, showCritical, showInfo, tooltip, openLink
-    from test.dummy_noteManager import getOrCreateDeck, getDeckList, getOrCreateModel, getOrCreateModelCardTemplate, addNoteToDeck, getWordsByDeck, getNotes
+    from test.dummy_aqt import mw, askUser, showCritical, showInfo, tooltip, openLink, CollectionOp
+    from test.dummy_noteManager import getOrCreateDeck, getDeckList, getOrCreateModel, getOrCreateModelCardTemplate, addNoteToDeck, buildNote, fillMissingValues, writeNotes, getWordsByDeck, getNotes, findTermsWithMissingAssets
 
 logger = logging.getLogger('dict2Anki')
 
@@ -55,6 +58,18 @@ class Windows(QDialog, mainUI.Ui_Dialog):
 
         self.added = 0
         self.deleted = 0
+        self.queried = 0                # words queried by the streaming sync
+        self.streamBuffer = []          # notes of the streaming sync waiting to be written, see flushStreamedNotes
+        self.streamWriting = False
+        self.streamDone = False
+        self.streamCancelled = False
+        self.mediaStore = None          # MediaStore of the last sync, when media is deduplicated
+        self.mediaIndex = None          # MediaIndex of the running DownloadMissingAssets
+
+        # incremental pull
+        self.pulledIncrementally = False
+        self.pulledPartially = False                    # some group failed, so no deletion detection
+        self.pendingWatermarks: {str: dict} = {}        # watermark key -> watermark, committed after a successful sync
 
         self.workerThread = QThread(self)
         self.workerThread.start()
@@ -67,6 +82,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.queryWorker = None
         self.pullWorker = None
         self.assetDownloadWorker = None
+        self.syncWorker = None
+        self.queryCache = None
 
         self.setupUi(self)
         self.setWindowTitle(WINDOW_TITLE)
@@ -118,6 +135,10 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             self.assetDownloadThread.quit()
             self.assetDownloadThread.wait()
 
+        # 查询线程结束后才关闭缓存, 避免仍在运行的查询写入已关闭的数据库
+        if self.queryCache:
+            self.queryCache.close()
+
         event.accept()
 
     def on_NewLogRecord(self, text):
@@ -163,6 +184,7 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.noPronRadioButton.setChecked(config['noPron'])
         self.BrEPronRadioButton.setChecked(config['BrEPron'])
         self.AmEPronRadioButton.setChecked(config['AmEPron'])
+        self.bypassCacheCheckBox.setChecked(config['bypassCache'])
 
         # card settings
         self.definitionEnCheckBox.setChecked(config['definition_en'])
@@ -208,6 +230,7 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             noPron=self.noPronRadioButton.isChecked(),
             BrEPron=self.BrEPronRadioButton.isChecked(),
             AmEPron=self.AmEPronRadioButton.isChecked(),
+            bypassCache=self.bypassCacheCheckBox.isChecked(),
 
             # note settings
             definition_en=self.definitionEnCheckBox.isChecked(),
@@ -217,6 +240,10 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             sentence=self.sentenceCheckBox.isChecked(),
             exam_type=self.examTypeCheckBox.isChecked(),
         )
+        # advanced settings (not in GUI)
+        storedConfig = mw.addonManager.getConfig(__name__)
+        for setting in ADVANCED_SETTINGS:
+            currentConfig[setting] = storedConfig[setting]
         configChanged, cardSettingsChanged = self._saveConfig(currentConfig)
         self.currentConfig = currentConfig
         return currentConfig, configChanged, cardSettingsChanged
@@ -263,15 +290,26 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         maskedConfig['credential'] = maskedCredential
         return maskedConfig
 
-    def getFieldGroup(self, config) -> FieldGroup:
+    def getFieldGroup(self, config, quiet=False) -> FieldGroup:
         """Check current card settings and toggle off corresponding fields"""
         fg = FieldGroup()
         for field in CARD_SETTINGS:
             if not config[field]:
-                logger.info(f"FieldGroup: '{field}' is toggled off. Will remove it from templates.")
+                if not quiet:
+                    logger.info(f"FieldGroup: '{field}' is toggled off. Will remove it from templates.")
                 fg.toggleOff(field)
         return fg
 
+    def getQueryCache(self, config):
+        """Open the query cache lazily, and apply current cache settings"""
+        if self.queryCache is None:
+            self.queryCache = QueryCache(QUERY_CACHE_FILE)
+        self.queryCache.ttl = config['cacheTTLDays'] * 24 * 3600
+        self.queryCache.max_entries = config['cacheMaxEntries']
+        self.queryCache.bypass = config['bypassCache']
+        self.queryCache.resetStats()
+        return self.queryCache
+
     def checkUpdate(self):
         @pyqtSlot(str, str)
         def on_haveNewVersion(version, changeLog):
@@ -342,6 +380,9 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         logger.info(f"Start importing")
         self.localWords = getWordsByDeck(self.deckComboBox.currentText())
         self.remoteWordsDict = {}
+        self.pulledIncrementally = False
+        self.pulledPartially = False
+        self.pendingWatermarks = {}
         self.insertWordToListWidget(words)
         self.on_allPullWork_done()
 
@@ -360,7 +401,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.selectedDict = dictionaries[currentConfig['selectedDict']]()
 
         # 登陆线程
-        self.loginWorker = LoginStateCheckWorker(self.selectedDict.checkCookie, json.loads(self.cookieLineEdit.text() or '{}'))
+        self.selectedDict.loginStateTTL = currentConfig['loginCacheMinutes'] * 60
+        self.loginWorker = LoginStateCheckWorker(self.selectedDict.checkLoginState, json.loads(self.cookieLineEdit.text() or '{}'))
         self.loginWorker.moveToThread(self.workerThread)
         self.loginWorker.start.connect(self.loginWorker.run)
         self.loginWorker.logSuccess.connect(self.onLogSuccess)
@@ -386,8 +428,12 @@ class Windows(QDialog, mainUI.Ui_Dialog):
     def onLogSuccess(self, cookie):
         self.cookieLineEdit.setText(cookie)
         self.getAndSaveCurrentConfig()
-        self.selectedDict.checkCookie(json.loads(cookie))
-        groups = self.selectedDict.getGroups()
+        self.selectedDict.checkLoginState(json.loads(cookie))
+        try:
+            groups = self.selectedDict.getGroups()
+        except LoginExpired:
+            self.onLoginFailed()
+            return
         if groups:
             logger.info(f"{len(groups)} group(s): {groups}")
         else:
@@ -457,19 +503,84 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         self.localWords = getWordsByDeck(self.deckComboBox.currentText())
         self.remoteWordsDict = {}
 
+        self.pulledIncrementally = False
+        self.pulledPartially = False
+        self.pendingWatermarks = {}
+        if self.currentConfig['streamingSync']:
+            self.startStreamingSync([(group_name, group_map[group_name],) for group_name in selected_groups])
+            return
+
+        watermarks = {}
+        if self.currentConfig['incrementalPull']:
+            storedWatermarks = self.loadWatermarks()
+            for group_name in selected_groups:
+                watermark = storedWatermarks.get(self.watermarkKey(group_map[group_name]))
+                # notes deleted from the deck since the last sync can only be found again by a full pull
+                if watermark and len(self.localWords) >= watermark['localCount']:
+                    watermarks[str(group_map[group_name])] = watermark
+
         # 启动单词获取线程
-        self.pullWorker = RemoteWordFetchingWorker(self.selectedDict, [(group_name, group_map[group_name],) for group_name in selected_groups])
+        self.pullWorker = RemoteWordFetchingWorker(self.selectedDict, [(group_name, group_map[group_name],) for group_name in selected_groups],
+                                                   watermarks)
         self.pullWorker.moveToThread(self.workerThread)
         self.pullWorker.start.connect(self.pullWorker.run)
         self.pullWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
         self.pullWorker.setProgress.connect(self.progressBar.setMaximum)
-        self.pullWorker.doneThisGroup.connect(self.insertWordToListWidget)
-        self.pullWorker.done.connect(self.on_allPullWork_done)
+        self.pullWorker.wordsPulled.connect(self.insertWordToListWidget)
+        self.pullWorker.doneThisGroup.connect(lambda groupName: logger.info(f'单词本({groupName})获取完毕'))
+        self.pullWorker.done.connect(self.on_remotePullDone)
         self.pullWorker.start.emit()
 
+    def watermarkKey(self, groupId) -> str:
+        return f'{self.selectedDict.name}/{self.deckComboBox.currentText()}/{groupId}'
+
+    @staticmethod
+    def loadWatermarks() -> dict:
+        try:
+            with open(WATERMARKS_FILE, encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def commitWatermarks(self):
+        """Record the watermarks of the last pull, once all its words are in the deck"""
+        if not self.pendingWatermarks:
+            return
+        localCount = len(getWordsByDeck(self.deckComboBox.currentText()))
+        unresolvedDeletions = self.needDeleteWordListWidget.count()
+        watermarks = utils.merge_watermarks(self.loadWatermarks(), self.pendingWatermarks, localCount, unresolvedDeletions)
+        os.makedirs(USER_FILES_DIR, exist_ok=True)
+        with open(WATERMARKS_FILE, 'w', encoding='utf8') as f:
+            json.dump(watermarks, f, ensure_ascii=False, indent=2)
+        if unresolvedDeletions:
+            logger.info(f'仍有 {unresolvedDeletions} 个待删单词未处理, 下次同步将全量获取: {list(self.pendingWatermarks)}')
+        else:
+            logger.info(f'已记录单词本同步位置: {list(self.pendingWatermarks)}')
+        self.pendingWatermarks = {}
+
+    @pyqtSlot()
+    def on_remotePullDone(self):
+        if self.pullWorker.loginExpired:
+            # the word list is incomplete: do not compare it with the deck
+            self.newWordListWidget.clear()
+            self.remoteWordsDict = {}
+            self.onLoginFailed()
+            return
+        self.pulledIncrementally = self.pullWorker.incremental
+        incompleteIds = {str(groupId) for _, groupId in self.pullWorker.incompleteGroups}
+        # words of a failed group are missing from the list: do not offer its local words for deletion
+        self.pulledPartially = bool(incompleteIds)
+        if self.pulledPartially:
+            groupNames = [groupName for groupName, _ in self.pullWorker.incompleteGroups]
+            logger.warning(f'单词本获取不完整: {groupNames}, 跳过删除检测')
+            showInfo(f'以下单词本获取失败, 本次不检测需要删除的单词: {", ".join(groupNames)}')
+        self.pendingWatermarks = {self.watermarkKey(groupId): watermark for groupId, watermark in self.pullWorker.newWatermarks.items()
+                                  if str(groupId) not in incompleteIds}
+        self.on_allPullWork_done()
+
     @pyqtSlot(list)
     def insertWordToListWidget(self, words: [SimpleWord]):
-        """一个分组获取完毕事件"""
+        """一页单词获取完毕事件"""
         for word in words:
             self.remoteWordsDict[word.term] = word
             wordItem = QListWidgetItem(word.term, self.newWordListWidget)
@@ -484,7 +595,12 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         remoteTermList = set([self.newWordListWidget.item(row).text() for row in range(self.newWordListWidget.count())])
 
         newTerms = utils.set_sub_ignore_case(remoteTermList, localTermList)           # 新单词
-        needToDeleteTerms = utils.set_sub_ignore_case(localTermList, remoteTermList)  # 需要删除的单词
+        if self.pulledIncrementally or self.pulledPartially:
+            # only new words were pulled, and the group totals confirmed nothing was deleted remotely,
+            # or some group failed, so its words are missing from the remote list
+            needToDeleteTerms = set()
+        else:
+            needToDeleteTerms = utils.set_sub_ignore_case(localTermList, remoteTermList)  # 需要删除的单词
         logger.info(f'本地({len(localTermList)}): {localTermList}')
         logger.info(f'远程({len(remoteTermList)}): {remoteTermList}')
         logger.info(f'待查({len(newTerms)}): {newTerms}')
@@ -516,9 +632,121 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         if self.needDeleteWordListWidget.count() == self.newWordListWidget.count() == 0:
             logger.info('无需同步')
             tooltip('无需同步')
+            self.commitWatermarks()
         self.mainTab.setEnabled(True)
         self.logHandler.flush()
 
+    def startStreamingSync(self, groups: [tuple]):
+        """Pull, query, add notes and download assets as one pipeline (advanced setting `streamingSync`)"""
+        currentConfig = self.currentConfig
+        fg = self.getFieldGroup(currentConfig)
+        self.streamModel, self.streamDeck = self.prepareModelAndDeck(currentConfig, fg)
+        if self.streamModel is None:
+            self.mainTab.setEnabled(True)
+            return
+
+        preferred_pron = self.get_preferred_pron(currentConfig)
+        self.added = 0
+        self.deleted = 0
+        self.queried = 0
+        self.mediaStore = None      # streaming sync keeps one file per term
+        self.streamBuffer = []      # [(query result, whichPron)] waiting to be written
+        self.streamWriting = False  # a batch is being written
+        self.streamDone = False     # the worker is done, so the rest of the buffer is written regardless of its size
+        self.streamCancelled = False
+        self.progressBar.setValue(0)
+        self.progressBar.setMaximum(0)
+        logger.info(f'流式同步: {groups}')
+        self.syncWorker = StreamingSyncWorker(
+            self.selectedDict, groups, self.localWords, apis[currentConfig['selectedApi']],
+            lambda word: self.get_asset_download_task(word, preferred_pron), mw.col.media.dir(),
+            cache=self.getQueryCache(currentConfig), fg=self.getFieldGroup(currentConfig, quiet=True)
+        )
+        self.syncWorker.moveToThread(self.workerThread)
+        self.syncWorker.wordQueried.connect(self.on_streamWordQueried)
+        self.syncWorker.pullDone.connect(self.on_streamPullDone)
+        self.syncWorker.done.connect(self.on_streamSyncDone)
+        self.syncWorker.start.connect(self.syncWorker.run)
+        self.syncWorker.start.emit()
+
+    @pyqtSlot(dict, int)
+    def on_streamWordQueried(self, result, pron_type):
+        self.streamBuffer.append((result, PRON_TYPES[pron_type]))
+        self.queried += 1
+        self.progressBar.setMaximum(self.queried)
+        self.progressBar.setValue(self.queried)
+        self.flushStreamedNotes()
+
+    def flushStreamedNotes(self):
+        """Write the notes of the streaming sync in batches of NOTE_WRITE_CHUNK_SIZE, one CollectionOp at a time"""
+        if self.streamWriting:
+            return      # the buffer is checked again once the batch in progress is written
+        if self.streamCancelled:
+            self.streamBuffer = []
+        if not self.streamBuffer or (len(self.streamBuffer) < NOTE_WRITE_CHUNK_SIZE and not self.streamDone):
+            if self.streamDone:
+                self.finishStreamingSync()
+            return
+
+        batch, self.streamBuffer = self.streamBuffer, []
+        deck, model, config = self.streamDeck, self.streamModel, self.currentConfig
+
+        def build():
+            notes = [buildNote(deck, model, config, word, whichPron) for word, whichPron in batch]
+            return [(note, deck['id']) for note, modified in notes if note is not None], [], 0
+
+        def onWritten(added, updated, skipped, cancelled):
+            self.added += added
+            self.streamWriting = False
+            if cancelled:
+                logger.warning(f'写入笔记已取消, 已添加 {self.added} 个单词, 剩余单词不再添加')
+                self.streamCancelled = True
+            self.flushStreamedNotes()
+
+        def onFailed():
+            self.streamWriting = False
+            self.streamCancelled = True
+            self.flushStreamedNotes()
+
+        self.streamWriting = True
+        self.writeNotesInBackground(build, 'Dict2Anki 流式同步', onWritten, onFailed, showProgress=False)
+
+    @pyqtSlot(list)
+    def on_streamPullDone(self, remoteTerms):
+        """Words to delete can only be known once every group is pulled"""
+        needToDeleteTerms = utils.set_sub_ignore_case(set(self.localWords), set(remoteTerms))
+        logger.info(f'待删({len(needToDeleteTerms)}): {needToDeleteTerms}')
+        delIcon = QIcon(':/icons/delete.png')
+        self.needDeleteWordListWidget.clear()
+        for term in needToDeleteTerms:
+            item = QListWidgetItem(term)
+            item.setCheckState(Qt.CheckState.Unchecked)    # Defaults to Unchecked (Avoid unintentional data loss)
+            item.setIcon(delIcon)
+            self.needDeleteWordListWidget.addItem(item)
+
+    @pyqtSlot()
+    def on_streamSyncDone(self):
+        self.streamDone = True
+        self.flushStreamedNotes()
+
+    def finishStreamingSync(self):
+        """Once the worker is done and every queried note is written"""
+        mw.reset()
+        self.progressBar.setMaximum(1)
+        self.progressBar.setValue(1)
+        self.pullRemoteWordsBtn.setEnabled(True)
+        self.queryBtn.setEnabled(False)
+        self.btnSync.setEnabled(self.needDeleteWordListWidget.count() > 0)
+        self.mainTab.setEnabled(True)
+        if self.syncWorker.loginExpired:
+            self.printSyncReport()
+            self.onLoginFailed()
+            return
+        tooltip(f'同步完成')
+        logger.info('同步完成')
+        self.printSyncReport()
+        self.logHandler.flush()
+
     @pyqtSlot()
     def on_queryBtn_clicked(self):
         logger.info('点击查询按钮')
@@ -546,7 +774,10 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         logger.info(f'待查询单词{wordList}')
         # 查询线程
         self.progressBar.setMaximum(len(wordList))
-        self.queryWorker = QueryWorker(wordList, apis[currentConfig['selectedApi']])
+        self.queryWorker = QueryWorker(wordList, apis[currentConfig['selectedApi']], self.getQueryCache(currentConfig),
+                                       engine=currentConfig['queryEngine'], concurrency=currentConfig['queryConcurrency'],
+                                       fg=self.getFieldGroup(currentConfig, quiet=True),
+                                       parseProcesses=currentConfig['parseProcesses'])
         self.queryWorker.moveToThread(self.workerThread)
         self.queryWorker.thisRowDone.connect(self.on_thisRowDone)
         self.queryWorker.thisRowFailed.connect(self.on_thisRowFailed)
@@ -622,7 +853,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         logger.info(f"Check query results")
         self.logHandler.flush()
         failedGenerator = (self.newWordListWidget.item(row).data(Qt.ItemDataRole.UserRole) is None for row in range(self.newWordListWidget.count()))
-        if any(failedGenerator):
+        allQueried = not any(failedGenerator)
+        if not allQueried:
             if not askUser('存在未查询或失败的单词，确定要加入单词本吗？\n 你可以选择失败的单词点击 "查询按钮" 来重试。'):
                 return
 
@@ -632,52 +864,9 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         currentConfig, configChanged, cardSettingsChanged = self.getAndSaveCurrentConfig_returnMetaInfo()
         fg = self.getFieldGroup(currentConfig)
 
-        # create Note Type/Model
-        logger.info(f"Create Note Type/Model")
-        self.logHandler.flush()
-        newCreated, fieldsUpdated = True, True
-        try:
-            model, newCreated, fieldsUpdated = getOrCreateModel(MODEL_NAME)
-        except Exception as err:
-            logger.warning(err)
-            if not askUser(f"{err}\nDeleting it would delete ALL its cards and notes!!! Continue?", defaultno=True):
-                logger.info("Aborted")
-                self.logHandler.flush()
-                return
-            if not askUser(f"[DANGEROUS ACTION!!!] Are you sure to delete model '{MODEL_NAME}' AND all its cards/notes???", defaultno=True):
-                logger.info("Aborted upon second reminder")
-                self.logHandler.flush()
-                return
-            # force delete the existing model
-            model = getOrCreateModel(MODEL_NAME, recreate=True)
-
-        if newCreated:
-            # create 'Normal' card template (card type)
-            logger.info(f"Create card templates for the new created model.")
-            self.logHandler.flush()
-            getOrCreateNormalCardTemplate(model, fg)
-            # create 'Backwards' card template (card type)
-            # getOrCreateBackwardsCardTemplate(model)
-        else:
-            logger.info(f"Found existing model.")
-            if currentConfig['syncTemplates']:
-                logger.info(f"Reset card templates to default (FieldGroup settings will be respected).")
-                self.logHandler.flush()
-                resetModelCardTemplates(model, fg)
-            else:
-                logger.info(f"Skip Templates Sync as it has been turned off.")
-
-        # else:           # existing model. (Let's make it simple: Reset card templates to default upon every sync.)
-        #     logger.info(f"Found existing model. Reset card templates to default (FieldGroup settings will be respected).")
-        #     self.logHandler.flush()
-        #     resetModelCardTemplates(model, fg)
-        # elif fieldsUpdated:     # existing model, but fields have been updated/merged
-        #     resetModelCardTemplates(model, fg)
-        # else:                   # existing model, and fields have not been updated/merged
-        #     pass
-
-        # create deck
-        deck = getOrCreateDeck(self.deckComboBox.currentText(), model=model)
+        model, deck = self.prepareModelAndDeck(currentConfig, fg)
+        if model is None:
+            return
 
         imagesDownloadTasks = []
         audiosDownloadTasks = []
@@ -691,6 +880,7 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             logger.info(f'Preferred Pronunciation: {PRON_TYPES[preferred_pron]}')
 
         self.added = 0
+        words = []
         for row in range(newWordCount):
             wordItem = self.newWordListWidget.item(row)
             wordItemData = wordItem.data(Qt.ItemDataRole.UserRole)
@@ -703,19 +893,51 @@ class Windows(QDialog, mainUI.Ui_Dialog):
                     imagesDownloadTasks.append(image_task)
                 if audio_task:
                     audiosDownloadTasks.append(audio_task)
+                words.append((wordItemData, PRON_TYPES[pron_type]))
+
+        mediaNames = {}
 
-                # add note
-                addNoteToDeck(deck, model, currentConfig, wordItemData, PRON_TYPES[pron_type])
-                self.added += 1
+        def build():
+            notes = [buildNote(deck, model, currentConfig, word, whichPron, mediaNames=mediaNames) for word, whichPron in words]
+            return [(note, deck['id']) for note, modified in notes if note is not None], [], 0
+
+        def write(imagesDownloadTasks, audiosDownloadTasks):
+            self.writeNotesInBackground(build, 'Dict2Anki 同步', lambda added, updated, skipped, cancelled: self.on_syncNotesWritten(
+                added, cancelled, currentConfig, imagesDownloadTasks, audiosDownloadTasks, allQueried))
+
+        # add notes
+        self.btnSync.setEnabled(False)
+        self.mediaStore = None
+        if currentConfig['dedupeMedia'] and (imagesDownloadTasks or audiosDownloadTasks):
+            # download first: notes refer to the files in the media store, whose names are known once stored
+            def onAssetsStored():
+                self.assetDownloadThread.quit()
+                mediaNames.update(self.assetDownloadWorker.fileNames)
+                write([], [])
+            self.mediaStore = MediaStore(mw.col.media.dir())
+            self.downloadAssets(imagesDownloadTasks, audiosDownloadTasks, onAssetsStored, store=self.mediaStore)
+        else:
+            write(imagesDownloadTasks, audiosDownloadTasks)
+
+    def on_syncNotesWritten(self, added, cancelled, currentConfig, imagesDownloadTasks, audiosDownloadTasks, allQueried):
+        """Second half of the sync, once the new notes are written"""
+        self.added = added
+        self.deleted = 0
         mw.reset()
+        self.btnSync.setEnabled(True)
+        self.newWordListWidget.clear()
+        if cancelled:
+            # the words written so far are in the deck now, so pull again to continue with the rest
+            logger.warning(f'同步已取消, 已添加 {added} 个单词. 请重新获取单词以继续')
+            self.printSyncReport()
+            self.logHandler.flush()
+            return
 
         # download assets
         if imagesDownloadTasks or audiosDownloadTasks:
             self.btnSync.setEnabled(False)
         self.downloadAssets(imagesDownloadTasks, audiosDownloadTasks, self.on_assetsDownloadDone)
 
-        self.newWordListWidget.clear()
-
         needToDeleteWordItems = [
             self.needDeleteWordListWidget.item(row)
             for row in range(self.needDeleteWordListWidget.count())
@@ -723,8 +945,6 @@ class Windows(QDialog, mainUI.Ui_Dialog):
         ]
         needToDeleteWords = [i.text() for i in needToDeleteWordItems]
 
-        self.deleted = 0
-
         if needToDeleteWords and askUser(f'确定要删除这些单词吗:{needToDeleteWords[:3]}...({len(needToDeleteWords)}个)', title='Dict2Anki', parent=self):
             logger.info(f"需要删除({len(needToDeleteWords)}) - {needToDeleteWords}")
             needToDeleteWordNoteIds = getNoteIDsOfWords(needToDeleteWords, currentConfig['deck'])
@@ -735,16 +955,118 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             for item in needToDeleteWordItems:
                 self.needDeleteWordListWidget.takeItem(self.needDeleteWordListWidget.row(item))
             logger.info(f'实际删除({self.deleted})')
+        if allQueried:
+            self.commitWatermarks()
         logger.info('完成')
 
         if not (imagesDownloadTasks or audiosDownloadTasks):
             self.printSyncReport()
         self.logHandler.flush()
 
+    def writeNotesInBackground(self, build, undoName: str, done_func, failed_func=None, showProgress=True):
+        """
+        Build and write notes in a CollectionOp, so that neither this window nor Anki freezes.
+        Progress goes to the progress bar and Anki's progress dialog; closing the dialog (Esc) cancels the remaining chunks.
+        The main tab is disabled until the notes are written.
+        :param build: called in the background, returns (newNotes, updatedNotes) for noteManager.writeNotes, and the
+                      number of notes skipped as unchanged
+        :param done_func: called with (added, updated, skipped, cancelled)
+        :param failed_func: called after the error is shown, if writing failed
+        :param showProgress: False to leave the progress bar of this window to the caller
+        """
+        result = {}
+        mainTabEnabled = self.mainTab.isEnabled()
+        self.mainTab.setEnabled(False)
+
+        def onProgress(done, total):
+            def update():
+                mw.progress.update(label=f'{undoName}: {done}/{total}', value=done, max=total)
+                if showProgress:
+                    self.progressBar.setMaximum(total)
+                    self.progressBar.setValue(done)
+            mw.taskman.run_on_main(update)
+
+        def op(col):
+            newNotes, updatedNotes, skipped = build()
+            added, updated, changes = writeNotes(newNotes, updatedNotes, undoName,
+                                                 onProgress=onProgress, isCancelled=mw.progress.want_cancel)
+            result.update(added=added, updated=updated, skipped=skipped,
+                          cancelled=added + updated < len(newNotes) + len(updatedNotes))
+            return changes
+
+        def onSuccess(changes):
+            self.mainTab.setEnabled(mainTabEnabled)
+            done_func(result['added'], result['updated'], result['skipped'], result['cancelled'])
+
+        def onFailure(exc):
+            logger.error(f'写入笔记失败: {exc}', exc_info=exc)
+            self.logHandler.flush()
+            self.mainTab.setEnabled(mainTabEnabled)
+            self.btnSync.setEnabled(True)
+            showCritical(f'写入笔记失败: {exc}')
+            if failed_func:
+                failed_func()
+
+        self.logHandler.flush()
+        CollectionOp(parent=self, op=op).success(onSuccess).failure(onFailure).run_in_background()
+
+    def prepareModelAndDeck(self, currentConfig, fg) -> (dict, dict):
+        """Create (or check) the Note Type/Model and its card templates, and the deck.
+        :return: (model, deck), or (None, None) if aborted by the user"""
+        # create Note Type/Model
+        logger.info(f"Create Note Type/Model")
+        self.logHandler.flush()
+        newCreated, fieldsUpdated = True, True
+        try:
+            model, newCreated, fieldsUpdated = getOrCreateModel(MODEL_NAME)
+        except Exception as err:
+            logger.warning(err)
+            if not askUser(f"{err}\nDeleting it would delete ALL its cards and notes!!! Continue?", defaultno=True):
+                logger.info("Aborted")
+                self.logHandler.flush()
+                return None, None
+            if not askUser(f"[DANGEROUS ACTION!!!] Are you sure to delete model '{MODEL_NAME}' AND all its cards/notes???", defaultno=True):
+                logger.info("Aborted upon second reminder")
+                self.logHandler.flush()
+                return None, None
+            # force delete the existing model
+            model = getOrCreateModel(MODEL_NAME, recreate=True)
+
+        if newCreated:
+            # create 'Normal' card template (card type)
+            logger.info(f"Create card templates for the new created model.")
+            self.logHandler.flush()
+            getOrCreateNormalCardTemplate(model, fg)
+            # create 'Backwards' card template (card type)
+            # getOrCreateBackwardsCardTemplate(model)
+        else:
+            logger.info(f"Found existing model.")
+            if currentConfig['syncTemplates']:
+                logger.info(f"Reset card templates to default (FieldGroup settings will be respected).")
+                self.logHandler.flush()
+                resetModelCardTemplates(model, fg)
+            else:
+                logger.info(f"Skip Templates Sync as it has been turned off.")
+
+        # else:           # existing model. (Let's make it simple: Reset card templates to default upon every sync.)
+        #     logger.info(f"Found existing model. Reset card templates to default (FieldGroup settings will be respected).")
+        #     self.logHandler.flush()
+        #     resetModelCardTemplates(model, fg)
+        # elif fieldsUpdated:     # existing model, but fields have been updated/merged
+        #     resetModelCardTemplates(model, fg)
+        # else:                   # existing model, and fields have not been updated/merged
+        #     pass
+
+        # create deck
+        deck = getOrCreateDeck(self.deckComboBox.currentText(), model=model)
+        return model, deck
+
     def printSyncReport(self):
         logger.info(f'Added: {self.added}, Deleted: {self.deleted}')
+        if self.mediaStore is not None:
+            logger.info(f'媒体去重: {self.mediaStore.stats()}')
 
-    def downloadAssets(self, imagesDownloadTasks, audiosDownloadTasks, done_func):
+    def downloadAssets(self, imagesDownloadTasks, audiosDownloadTasks, done_func, store=None, index=None):
         logger.info(f"Image download tasks({len(imagesDownloadTasks)}): {imagesDownloadTasks}")
         logger.info(f"Audio download tasks({len(audiosDownloadTasks)}): {audiosDownloadTasks}")
         if imagesDownloadTasks or audiosDownloadTasks:
@@ -757,7 +1079,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
 
             self.assetDownloadThread = QThread(self)
             self.assetDownloadThread.start()
-            self.assetDownloadWorker = AssetDownloadWorker(mw.col.media.dir(), imagesDownloadTasks, audiosDownloadTasks)
+            self.assetDownloadWorker = AssetDownloadWorker(mw.col.media.dir(), imagesDownloadTasks, audiosDownloadTasks,
+                                                           store=store, index=index)
             self.assetDownloadWorker.moveToThread(self.assetDownloadThread)
             self.assetDownloadWorker.tick.connect(lambda: self.progressBar.setValue(self.progressBar.value() + 1))
             self.assetDownloadWorker.start.connect(self.assetDownloadWorker.run)
@@ -775,7 +1098,10 @@ class Windows(QDialog, mainUI.Ui_Dialog):
 
     def queryWords(self, wordList: [(SimpleWord, int)], dictAPI, all_done_func):
         # self.progressBar.setMaximum(len(wordList))
-        self.queryWorker = QueryWorker(wordList, dictAPI)
+        self.queryWorker = QueryWorker(wordList, dictAPI, self.getQueryCache(self.tmp_currentConfig),
+                                       engine=self.tmp_currentConfig['queryEngine'], concurrency=self.tmp_currentConfig['queryConcurrency'],
+                                       fg=self.getFieldGroup(self.tmp_currentConfig, quiet=True),
+                                       parseProcesses=self.tmp_currentConfig['parseProcesses'])
         self.queryWorker.moveToThread(self.workerThread)
         self.queryWorker.thisRowDone.connect(self.on_thisRowDone)
         self.queryWorker.thisRowFailed.connect(self.on_thisRowFailed)
@@ -787,26 +1113,18 @@ class Windows(QDialog, mainUI.Ui_Dialog):
     tmp_currentConfig = None
     """for DownloadMissingAssets or FillMissingValues only"""
 
+    tmp_missingAssets: dict = {}      # row -> (missing image filename, missing audio filename)
+    """for DownloadMissingAssets only"""
+
     @pyqtSlot()
     def on_btnDownloadMissingAssets_clicked(self):
         """Download missing assets for all notes of type Dict2Anki in ALL decks"""
         self.tmp_currentConfig = self.getAndSaveCurrentConfig()
-        # model = mw.col.models.by_name(MODEL_NAME)
-        noteIds = mw.col.findNotes(f"note:{MODEL_NAME}")
-        logger.info(f"Found ({len(noteIds)}) notes of type '{MODEL_NAME}'")
-        self.logHandler.flush()
 
         # find words that have missing assets
-        wordList: [(SimpleWord, int)] = []      # [(SimpleWord, row)]
-        for noteId in noteIds:
-            note = mw.col.getNote(noteId)
-            term = note['term']
-            media_dir = mw.col.media.dir()
-            # logger.info(f"Checking term {term}")
-            if utils.is_image_file_missing(note['image'], media_dir) or utils.is_audio_file_missing(note['pronunciation'], media_dir):
-                # logger.warning(f"image or audio file is missing for [{term}]")
-                word, row = SimpleWord(term), len(wordList)
-                wordList.append((word, row))
+        mediaIndex = MediaIndex(mw.col.media.dir())
+        missingAssets = findTermsWithMissingAssets(mediaIndex)
+        wordList: [(SimpleWord, int)] = [(SimpleWord(term), row) for row, (term, _, _) in enumerate(missingAssets)]
         terms = [w.term for w, r in wordList]
         if not terms:
             logger.info(f"[All clear] Nothing to do.")
@@ -822,6 +1140,8 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             return
 
         # query words
+        self.mediaIndex = mediaIndex
+        self.tmp_missingAssets = {row: (imageName, audioName) for row, (_, imageName, audioName) in enumerate(missingAssets)}
         self.querySuccessDict = {}
         self.queryFailedDict = {}
         self.queryWords(wordList, apis[self.tmp_currentConfig['selectedApi']], self.__on_allQueryDone_DownloadMissingAssets)
@@ -852,12 +1172,15 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             logger.debug(f"word ({term}): {word}")
             # Add asset download task (image and audio)
             image_task, audio_task, pron_type, is_fallback = self.get_asset_download_task(word, preferred_pron)
-            if image_task:
-                imagesDownloadTasks.append(image_task)
-            if audio_task:
-                audiosDownloadTasks.append(audio_task)
+            # download to the filenames the note references, which differ from the default ones for deduplicated media
+            imageName, audioName = self.tmp_missingAssets[row]
+            if image_task and imageName:
+                imagesDownloadTasks.append((imageName, image_task[1]))
+            if audio_task and audioName:
+                audiosDownloadTasks.append((audioName, audio_task[1]))
         # download assets
-        self.downloadAssets(imagesDownloadTasks, audiosDownloadTasks, self.__on_assetsDownloadDone_DownloadMissingAssets)
+        self.downloadAssets(imagesDownloadTasks, audiosDownloadTasks, self.__on_assetsDownloadDone_DownloadMissingAssets,
+                            index=self.mediaIndex)
 
     @pyqtSlot()
     def __on_assetsDownloadDone_DownloadMissingAssets(self):
@@ -926,17 +1249,26 @@ class Windows(QDialog, mainUI.Ui_Dialog):
             logger.info(f'Preferred Pronunciation: {PRON_TYPES[preferred_pron]}')
 
         self.logHandler.flush()
+        words = []
         for row, word in self.querySuccessDict.items():
             term = word['term']
             logger.debug(f"word ({term}): {word}")
             # resolve image and audio information (for use in field values)
             image_task, audio_task, pron_type, is_fallback = self.get_asset_download_task(word, preferred_pron)
-            # update note (fill missing field values)
-            existing_note = self.tmp_noteDict[term]
-            addNoteToDeck(None, None, self.tmp_currentConfig, word, PRON_TYPES[pron_type], existing_note, False)
+            words.append((word, PRON_TYPES[pron_type], self.tmp_noteDict[term]))
+        config = self.tmp_currentConfig
+
+        def build():
+            # update notes (fill missing field values). Notes without any missing value are left untouched.
+            updatedNotes, skipped = fillMissingValues(config, words)
+            return [], updatedNotes, skipped
+
+        self.writeNotesInBackground(build, 'Dict2Anki Fill Missing Values', self.__on_notesWritten_FillMissingValues)
+
+    def __on_notesWritten_FillMissingValues(self, added, updated, skipped, cancelled):
+        """for btnFillMissingValues"""
         mw.reset()
-        self.logHandler.flush()
-        logger.info(f"Done!")
+        logger.info(f"{'Cancelled' if cancelled else 'Done'}! Updated: {updated}, Skipped (unchanged): {skipped}")
         self.logHandler.flush()
 
     @pyqtSlot()
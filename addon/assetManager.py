@@ -0,0 +1,300 @@
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Lock
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from .constants import ASSET_MAX_WORKERS, ASSET_DEFAULT_HOST_LIMIT, ASSET_MAX_PENDING, ASSET_HOST_LIMITS, \
+    ASSET_FILENAME_PREFIX, ASSET_TIMEOUT, ASSET_CHUNK_SIZE, MEDIA_MANIFEST_FILE
+
+logger = logging.getLogger('dict2Anki.assetManager')
+
+
+def partPathOf(filepath: str) -> str:
+    """Hidden file next to `filepath` that holds its data while downloading"""
+    return os.path.join(os.path.dirname(filepath), f'.{os.path.basename(filepath)}.part')
+
+
+def createDownloadSession() -> requests.Session:
+    """
+    Session for asset downloads. Reads are never retried and connects only briefly, so that a stalled host gives up
+    after ASSET_TIMEOUT instead of holding a pool thread through urllib3 backoffs; the caller retries whole downloads,
+    resuming their part files.
+    """
+    retries = Retry(total=2, connect=2, read=0, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(max_retries=retries, pool_maxsize=ASSET_MAX_WORKERS))
+    session.mount('https://', HTTPAdapter(max_retries=retries, pool_maxsize=ASSET_MAX_WORKERS))
+    return session
+
+
+def downloadFile(session, url: str, filepath: str, timeout=ASSET_TIMEOUT, isInterrupted=lambda: False,
+                 chunkSize=ASSET_CHUNK_SIZE) -> bool:
+    """
+    Download `url` into `filepath` atomically: data goes to a part file (see partPathOf), which is renamed to `filepath`
+    once complete, so `filepath` never holds a truncated file. A part file left by an earlier attempt is resumed with an
+    HTTP Range request.
+    :param timeout: (connect, read) timeouts in seconds
+    :return: False if interrupted. Network errors and incomplete responses raise, keeping the part file for a retry.
+    """
+    partPath = partPathOf(filepath)
+    offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with session.get(url, stream=True, timeout=timeout, headers=headers) as r:
+        if r.status_code == 416:
+            # the part file does not match the remote file any more
+            os.remove(partPath)
+            raise IOError(f'{url}: range not satisfiable, restarting')
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0      # the server ignored the range, and sends the whole file
+        expected = None
+        if 'Content-Length' in r.headers and 'Content-Encoding' not in r.headers:
+            expected = offset + int(r.headers['Content-Length'])
+        with open(partPath, 'ab' if offset else 'wb', buffering=chunkSize) as f:
+            for chunk in r.iter_content(chunk_size=chunkSize):
+                if isInterrupted():
+                    return False
+                f.write(chunk)
+            size = f.tell()
+    if expected is not None and size < expected:
+        raise IOError(f'{url}: incomplete download ({size}/{expected} bytes)')
+    os.replace(partPath, filepath)
+    return True
+
+
+class AssetScheduler:
+    """
+    Run asset downloads on one thread pool of `maxWorkers` threads (the global cap), with at most `hostLimit(host)`
+    downloads per host at a time. Downloads of a host at its limit wait in a queue of that host rather than in the pool,
+    so a slow host never holds pool threads that the other hosts could use.
+    At most `maxPending` downloads are queued or running: `submit` blocks until one of them is done, so that a producer
+    (e.g. the streaming sync) is slowed down to the download rate instead of queueing every asset of a large deck.
+    """
+
+    def __init__(self, maxWorkers=ASSET_MAX_WORKERS, hostLimits: dict = None, defaultHostLimit=ASSET_DEFAULT_HOST_LIMIT,
+                 maxPending=ASSET_MAX_PENDING):
+        """
+        :param hostLimits: {domain: limit}, also applied to subdomains. Defaults to ASSET_HOST_LIMITS.
+        """
+        self.hostLimits = ASSET_HOST_LIMITS if hostLimits is None else hostLimits
+        self.defaultHostLimit = defaultHostLimit
+        self.maxPending = max(1, maxPending)
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self._lock = Lock()
+        self._changed = Condition(self._lock)   # notified when a download is done
+        self._running = defaultdict(int)        # host -> downloads in the pool
+        self._pending = defaultdict(deque)      # host -> downloads waiting for the host
+        self._unfinished = 0                    # downloads submitted and not done yet
+
+    @staticmethod
+    def host(url: str) -> str:
+        return (urlparse(url).hostname or '').lower()
+
+    def hostLimit(self, host: str) -> int:
+        for domain, limit in self.hostLimits.items():
+            if host == domain or host.endswith('.' + domain):
+                return limit
+        return self.defaultHostLimit
+
+    def submit(self, url: str, fn, *args, **kwargs) -> Future:
+        """
+        Schedule `fn(*args, **kwargs)` as a download from `url`. Blocks while `maxPending` downloads are unfinished.
+        :return: Future of its result
+        """
+        host = self.host(url)
+        task = (host, fn, args, kwargs, Future())
+        with self._lock:
+            while self._unfinished >= self.maxPending:
+                self._changed.wait()
+            self._unfinished += 1
+            if self._running[host] < self.hostLimit(host):
+                self._running[host] += 1
+                self._executor.submit(self._run, task)
+            else:
+                self._pending[host].append(task)
+        return task[-1]
+
+    def _run(self, task):
+        host, fn, args, kwargs, future = task
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            logger.exception(e)
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._pending[host]:
+                    self._executor.submit(self._run, self._pending[host].popleft())
+                else:
+                    self._running[host] -= 1
+                self._unfinished -= 1
+                self._changed.notify_all()
+
+    def join(self):
+        """Blocks until every submitted download is done"""
+        with self._lock:
+            while self._unfinished:
+                self._changed.wait()
+
+    def shutdown(self):
+        self.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+class MediaIndex:
+    """
+    Names of the add-on's asset files (starting with `prefix`) in the media folder, read with a single os.scandir and
+    kept up to date with `add` as downloads finish, so that existence checks do not stat every file.
+    Names without the prefix are not indexed, and are checked on disk.
+    """
+
+    def __init__(self, mediaDir: str, prefix=ASSET_FILENAME_PREFIX):
+        self.mediaDir = mediaDir
+        self.prefix = prefix
+        self.caseSensitive = True
+        self._names = set()
+        self._lock = Lock()
+        self.refresh()
+
+    def refresh(self):
+        names = set()
+        try:
+            with os.scandir(self.mediaDir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(self.prefix):
+                        names.add(entry.name)
+        except OSError as e:
+            logger.warning(f'读取媒体文件夹失败: {e}')
+        # on case-insensitive file systems (Windows, macOS) 'MG-Apple.jpg' exists if 'MG-apple.jpg' does
+        sample = next((name for name in names if name.swapcase() != name), None)
+        caseSensitive = sample is None or not os.path.exists(os.path.join(self.mediaDir, sample.swapcase()))
+        with self._lock:
+            self.caseSensitive = caseSensitive
+            self._names = names if caseSensitive else {name.lower() for name in names}
+        logger.info(f'媒体索引: {len(names)} 个文件')
+
+    def _key(self, fileName: str) -> str:
+        return fileName if self.caseSensitive else fileName.lower()
+
+    def __contains__(self, fileName: str) -> bool:
+        if not fileName.startswith(self.prefix):
+            return os.path.exists(os.path.join(self.mediaDir, fileName))
+        with self._lock:
+            return self._key(fileName) in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, fileName: str):
+        if fileName.startswith(self.prefix):
+            with self._lock:
+                self._names.add(self._key(fileName))
+
+
+class MediaStore:
+    """
+    Content-addressed asset storage: files are named after the sha256 of their content, so an image or audio file shared
+    by several notes is stored (and synced by Anki) once. A manifest maps urls to content hashes, and hashes to files,
+    so that known urls are not downloaded again at all.
+    """
+
+    def __init__(self, mediaDir: str, manifestPath=MEDIA_MANIFEST_FILE, index: MediaIndex = None):
+        self.mediaDir = mediaDir
+        self.manifestPath = manifestPath
+        self.index = index if index is not None else MediaIndex(mediaDir)
+        self.bytesSaved = 0
+        self.reused = 0
+        self._lock = Lock()
+        manifest = {}
+        try:
+            with open(manifestPath, encoding='utf8') as f:
+                manifest = json.load(f).get(mediaDir, {})
+        except (OSError, ValueError):
+            pass
+        self.urls = manifest.get('urls', {})        # url -> sha256
+        self.hashes = manifest.get('hashes', {})    # sha256 -> filename
+
+    def lookup(self, url: str) -> str:
+        """:return: name of the stored file downloaded from `url`, or None"""
+        with self._lock:
+            fileName = self.hashes.get(self.urls.get(url))
+        if fileName and fileName in self.index:
+            return fileName
+        return None
+
+    def download(self, url: str, fileName: str, fetch) -> str:
+        """
+        Store the asset at `url`, reusing a stored file when the url or the content is already known.
+        :param fileName: name the asset would have without deduplication, for its extension
+        :param fetch: called with (target_dir, fileName, url) to download into a file, returns success
+        :return: name of the stored file, or None if the download failed
+        """
+        storedName = self.lookup(url)
+        if storedName:
+            self._saved(storedName)
+            return storedName
+        tmpName = f'.{fileName}.download'
+        tmpPath = os.path.join(self.mediaDir, tmpName)
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        if not fetch(self.mediaDir, tmpName, url):
+            return None
+        return self.add(url, tmpPath, os.path.splitext(fileName)[1])
+
+    def add(self, url: str, path: str, ext: str) -> str:
+        """Move a downloaded file into the store, or drop it if its content is stored already. :return: stored name"""
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        storedName = f'{ASSET_FILENAME_PREFIX}-{digest[:16]}{ext}'
+        storedPath = os.path.join(self.mediaDir, storedName)
+        with self._lock:
+            self.urls[url] = digest
+            duplicate = storedName in self.index
+            if duplicate:
+                os.remove(path)
+            else:
+                os.replace(path, storedPath)
+                self.index.add(storedName)
+            self.hashes[digest] = storedName
+        if duplicate:
+            self._saved(storedName)
+        return storedName
+
+    def _saved(self, fileName: str):
+        size = os.path.getsize(os.path.join(self.mediaDir, fileName))
+        with self._lock:
+            self.reused += 1
+            self.bytesSaved += size
+
+    def save(self):
+        with self._lock:
+            try:
+                with open(self.manifestPath, encoding='utf8') as f:
+                    manifests = json.load(f)
+            except (OSError, ValueError):
+                manifests = {}
+            manifests[self.mediaDir] = {'urls': self.urls, 'hashes': self.hashes}
+            os.makedirs(os.path.dirname(self.manifestPath), exist_ok=True)
+            with open(self.manifestPath, 'w', encoding='utf8') as f:
+                json.dump(manifests, f, ensure_ascii=False)
+
+    def stats(self) -> str:
+        return f'复用 {self.reused} 个文件, 节省 {self.bytesSaved / 1024:.1f} KiB'
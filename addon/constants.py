@@ -1,3 +1,5 @@
+import os
+
 VERSION = 'v6.3.6k'
 RELEASE_URL = 'https://github.com/lixvbnet/Dict2Anki'
 VERSION_CHECK_API = 'https://api.github.com/repos/lixvbnet/Dict2Anki/releases/latest'
@@ -11,6 +13,24 @@ HEADERS = {
 
 LOG_BUFFER_CAPACITY = 20    # number of log items
 LOG_FLUSH_INTERVAL = 3      # seconds
+NOTE_WRITE_CHUNK_SIZE = 500  # notes written per collection call during sync
+ASSET_MAX_WORKERS = 8       # concurrent asset downloads, across all hosts
+ASSET_DEFAULT_HOST_LIMIT = 4
+ASSET_MAX_PENDING = 200    # asset downloads queued or running, before submitting more blocks
+ASSET_TIMEOUT = (10, 30)    # seconds to connect, and between two reads of a download
+ASSET_CHUNK_SIZE = 64 * 1024
+ASSET_HOST_LIMITS = {       # concurrent downloads per host, matched by domain suffix
+    'dict.youdao.com': 4,   # audio
+    'api.frdic.com': 2,     # audio
+    'nosdn.127.net': 6,     # images
+    'ydstatic.com': 6,      # images
+}
+
+# Anki keeps the add-on's `user_files` folder across updates
+USER_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'user_files')
+QUERY_CACHE_FILE = os.path.join(USER_FILES_DIR, 'query_cache.db')
+WATERMARKS_FILE = os.path.join(USER_FILES_DIR, 'watermarks.json')
+MEDIA_MANIFEST_FILE = os.path.join(USER_FILES_DIR, 'media_manifest.json')
 
 # continue to use Dict2Anki 4.x model
 ASSET_FILENAME_PREFIX = "MG"
@@ -26,10 +46,14 @@ MODEL_FIELDS = [
     'group', 'exam_type', 'modifiedTime',
 ]
 CARD_SETTINGS = ['definition_en', 'image', 'pronunciation', 'phrase', 'sentence', 'exam_type']
+# settings without a GUI widget (edit them via Tools - Add-ons - Config)
+ADVANCED_SETTINGS = ['cacheTTLDays', 'cacheMaxEntries', 'queryEngine', 'queryConcurrency', 'parseProcesses', 'streamingSync',
+                     'incrementalPull', 'loginCacheMinutes', 'dedupeMedia']
 
 
 class FieldGroup:
     def __init__(self):
+        self.disabled = set()
         self.definition_en = "{{definition_en}}"
         self.image = "{{image}}"
         self.pronunciation = "{{pronunciation}}"
@@ -48,6 +72,7 @@ class FieldGroup:
     def toggleOff(self, field):
         if field not in CARD_SETTINGS:
             raise RuntimeError(f"Unexpected field: {field}. Must be in {CARD_SETTINGS}!")
+        self.disabled.add(field)
         if field == 'phrase':
             setattr(self, field, [
                 ("", "", ""),
@@ -63,6 +88,9 @@ class FieldGroup:
         else:
             setattr(self, field, "")
 
+    def isEnabled(self, field) -> bool:
+        return field not in self.disabled
+
     def toString(self) -> str:
         return f"definition_en={self.definition_en}, image={self.image}, pronunciation={self.pronunciation}, phrase={self.phrase}, sentence={self.sentence}"
 
@@ -1,14 +1,13 @@
 import time
 import logging
 import requests
-import requests.utils
 from math import ceil
 from bs4 import BeautifulSoup
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
 from ..constants import HEADERS
-from ..misc import AbstractDictionary, SimpleWord
+from ..misc import AbstractDictionary, LoginExpired, SimpleWord
 
 logger = logging.getLogger('dict2Anki.dictionary.eudict')
 
@@ -22,6 +21,7 @@ class Eudict(AbstractDictionary):
     session.headers = HEADERS
     session.mount('http://', HTTPAdapter(max_retries=retries))
     session.mount('https://', HTTPAdapter(max_retries=retries))
+    studyListUrl = 'https://my.eudic.net/studylist'
 
     def __init__(self):
         self.groups = []
@@ -33,12 +33,12 @@ class Eudict(AbstractDictionary):
         :param cookie:
         :return: Boolean cookie是否有效
         """
-        rsp = requests.get('https://my.eudic.net/studylist', cookies=cookie, headers=HEADERS)
+        rsp = self.session.get(self.studyListUrl, cookies=cookie, timeout=self.timeout)
         if 'dict.eudic.net/account/login' not in rsp.url:
+            # the study list page also lists the groups
             self.indexSoup = BeautifulSoup(rsp.text, features="html.parser")
             logger.info('Cookie有效')
-            cookiesJar = requests.utils.cookiejar_from_dict(cookie, cookiejar=None, overwrite=True)
-            self.session.cookies = cookiesJar
+            self.useCookie(cookie)
             return True
         logger.info('Cookie失效')
         return False
@@ -54,6 +54,12 @@ class Eudict(AbstractDictionary):
         获取单词本分组
         :return: [(group_name,group_id)]
         """
+        if self.indexSoup is None:     # login state was cached, so the study list page has not been fetched yet
+            rsp = self.session.get(self.studyListUrl, timeout=self.timeout)
+            if 'dict.eudic.net/account/login' in rsp.url:
+                self.forgetLoginState()
+                raise LoginExpired(rsp.url)
+            self.indexSoup = BeautifulSoup(rsp.text, features="html.parser")
         elements = self.indexSoup.find_all('a', class_='media_heading_a new_cateitem_click')
         groups = []
         if elements:
@@ -86,6 +92,32 @@ class Eudict(AbstractDictionary):
 
     def getWordsByPage(self, pageNo: int, groupName: str, groupId: int) -> [SimpleWord]:
         wordList = []
+        try:
+            logger.info(f'获取单词本({groupName}-{groupId})第:{pageNo + 1}页')
+            wordList, _ = self._getPage(pageNo, groupId)
+        except LoginExpired:
+            raise
+        except Exception as error:
+            logger.exception(f'网络异常{error}')
+        logger.info(wordList)
+        return wordList
+
+    def getFirstPage(self, groupName: str, groupId: int) -> ([SimpleWord], int):
+        try:
+            logger.info(f'获取单词本({groupName}-{groupId})第:1页')
+            wordList, records = self._getPage(0, groupId)
+            totalPages = ceil(records / 100)
+            logger.info(f'该分组({groupName}-{groupId})下共有{totalPages}页')
+            logger.info(wordList)
+            return wordList, totalPages
+        except LoginExpired:
+            raise
+        except Exception as error:
+            logger.exception(f'网络异常{error}')
+            return [], None
+
+    def _getPage(self, pageNo: int, groupId: int) -> ([SimpleWord], int):
+        """:return: (words of the page, total word count of the group)"""
         data = {
             'columns[2][data]': 'word',
             'start': pageNo * 100,
@@ -93,20 +125,16 @@ class Eudict(AbstractDictionary):
             'categoryid': groupId,
             '_': int(time.time()) * 1000,
         }
-        try:
-            logger.info(f'获取单词本({groupName}-{groupId})第:{pageNo + 1}页')
-            r = self.session.post(
-                url='https://my.eudic.net/StudyList/WordsDataSource',
-                timeout=self.timeout,
-                data=data
-            )
-            wl = r.json()
-            wordList = [SimpleWord(word['uuid']) for word in wl['data']]
-        except Exception as error:
-            logger.exception(f'网络异常{error}')
-        finally:
-            logger.info(wordList)
-            return wordList
+        r = self.session.post(
+            url='https://my.eudic.net/StudyList/WordsDataSource',
+            timeout=self.timeout,
+            data=data
+        )
+        if r.status_code == 401 or 'account/login' in r.url:
+            self.forgetLoginState()
+            raise LoginExpired(f'code:{r.status_code} url:{r.url}')
+        wl = r.json()
+        return [SimpleWord(word['uuid']) for word in wl['data']], wl['recordsTotal']
 
     @classmethod
     def close(cls):
@@ -1,12 +1,11 @@
 import logging
 from math import ceil
+from threading import Lock
 import requests
-import requests.utils
-from bs4 import BeautifulSoup
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 from ..constants import HEADERS
-from ..misc import AbstractDictionary, SimpleWord
+from ..misc import AbstractDictionary, LoginExpired, SimpleWord
 
 logger = logging.getLogger('dict2Anki.dictionary.youdao')
 
@@ -20,10 +19,15 @@ class Youdao(AbstractDictionary):
     session.headers = HEADERS
     session.mount('http://', HTTPAdapter(max_retries=retries))
     session.mount('https://', HTTPAdapter(max_retries=retries))
+    wordsUrl = 'http://dict.youdao.com/wordbook/webapi/words'
+    DEFAULT_PAGE_SIZE = 15      # 网页默认每页15个
+    PAGE_SIZE_CANDIDATES = (1000, 300, 100, DEFAULT_PAGE_SIZE)
+    pageSize = None             # largest page size the server honours, probed until a group proves it, and shared
+    pageSizeLock = Lock()
 
     def __init__(self):
-        self.indexSoup = None
         self.groups = []
+        self.groupPageSize = {}     # groupId -> page size its page numbers refer to
 
     def checkCookie(self, cookie: dict) -> bool:
         """
@@ -31,12 +35,10 @@ class Youdao(AbstractDictionary):
         :param cookie:
         :return: bool
         """
-        rsp = requests.get('http://dict.youdao.com/login/acc/query/accountinfo', cookies=cookie, headers=HEADERS)
+        rsp = self.session.get('http://dict.youdao.com/login/acc/query/accountinfo', cookies=cookie, timeout=self.timeout)
         if rsp.json().get('code', None) == 0:
-            self.indexSoup = BeautifulSoup(rsp.text, features="html.parser")
             logger.info('Cookie有效')
-            cookiesJar = requests.utils.cookiejar_from_dict(cookie, cookiejar=None, overwrite=True)
-            self.session.cookies = cookiesJar
+            self.useCookie(cookie)
             return True
         logger.info('Cookie失效')
         return False
@@ -70,19 +72,15 @@ class Youdao(AbstractDictionary):
         :return:
         """
         try:
-            r = self.session.get(
-                url='http://dict.youdao.com/wordbook/webapi/words',
-                timeout=self.timeout,
-                params={'bookId': groupId, 'limit': 1, 'offset': 0}
-            )
-            totalWords = r.json()['data']['total']
-            totalPages = ceil(totalWords / 15)  # 这里按网页默认每页取15个
+            pageSize = self.groupPageSize[groupId] = self.getPageSize(groupId)
+            totalWords = self._getWords(groupId, limit=1, offset=0)['total']
+            totalPages = ceil(totalWords / pageSize)
 
         except Exception as error:
             logger.exception(f'网络异常{error}')
 
         else:
-            logger.info(f'该分组({groupName}-{groupId})下共有{totalPages}页')
+            logger.info(f'该分组({groupName}-{groupId})下共有{totalPages}页(每页{pageSize}个)')
             return totalPages
 
     def getWordsByPage(self, pageNo: int, groupName: str, groupId: str) -> [SimpleWord]:
@@ -96,17 +94,131 @@ class Youdao(AbstractDictionary):
         wordList = []
         try:
             logger.info(f'获取单词本({groupName}-{groupId})第:{pageNo}页')
-            r = self.session.get(
-                'http://dict.youdao.com/wordbook/webapi/words',
-                timeout=self.timeout,
-                params={'bookId': groupId, 'limit': 15, 'offset': pageNo * 15}
-            )
-            wordList = [SimpleWord(item['word'], item['trans'], modifiedTime=item['modifiedTime'], bookId=item['bookId'], bookName=item['bookName']) for item in r.json()['data']['itemList']]
+            wordList, _ = self._getPage(pageNo, groupId)
+        except LoginExpired:
+            raise
         except Exception as e:
             logger.exception(f'网络异常{e}')
-        finally:
+        logger.info(wordList)
+        return wordList
+
+    def getFirstPage(self, groupName: str, groupId: str) -> ([SimpleWord], int):
+        try:
+            logger.info(f'获取单词本({groupName}-{groupId})第:0页')
+            pageSize, data = self._probePageSize(groupId)
+            self.groupPageSize[groupId] = pageSize
+            if data is None:
+                wordList, totalWords = self._getPage(0, groupId)
+            else:   # the probe already fetched page 0
+                wordList, totalWords = [self._toSimpleWord(item) for item in data['itemList']], data['total']
+            totalPages = ceil(totalWords / pageSize)
+            logger.info(f'该分组({groupName}-{groupId})下共有{totalPages}页(每页{pageSize}个)')
             logger.info(wordList)
-            return wordList
+            return wordList, totalPages
+        except LoginExpired:
+            raise
+        except Exception as e:
+            logger.exception(f'网络异常{e}')
+            return [], None
+
+    def _getPage(self, pageNo: int, groupId: str) -> ([SimpleWord], int):
+        """:return: (words of the page, total word count of the group)"""
+        pageSize = self.groupPageSize.get(groupId) or self.getPageSize(groupId)
+        offset = pageNo * pageSize
+        data = self._getWords(groupId, limit=pageSize, offset=offset)
+        items = data['itemList']
+        end = min(offset + pageSize, data['total'])
+        # the server capped the page below the probed size: fetch the rest of the page, and page smaller next time
+        while items and offset + len(items) < end:
+            logger.warning(f'每页{pageSize}个被限制为{len(items)}个')
+            Youdao.pageSize = min(Youdao.pageSize or pageSize, len(items))
+            more = self._getWords(groupId, limit=end - offset - len(items), offset=offset + len(items))['itemList']
+            if not more:
+                break
+            items = items + more
+        return [self._toSimpleWord(item) for item in items], data['total']
+
+    def getWordsSince(self, groupName: str, groupId: str, modifiedTime: int) -> ([SimpleWord], int):
+        """
+        按修改时间倒序获取, 直到遇到不晚于 `modifiedTime` 的单词.
+        Uses the default page size, as only a few words are expected to be new.
+        :return: (words, total), or None if the pages are not in time order or on network errors
+        """
+        words = []
+        offset = 0
+        try:
+            while True:
+                logger.info(f'增量获取单词本({groupName}-{groupId}) offset:{offset}')
+                data = self._getWords(groupId, limit=self.DEFAULT_PAGE_SIZE, offset=offset, sort='time')
+                page = [self._toSimpleWord(item) for item in data['itemList']]
+                times = [word.modifiedTime for word in page]
+                if times != sorted(times, reverse=True):
+                    logger.warning(f'单词本({groupName}-{groupId})未按时间排序, 无法增量获取')
+                    return None
+                newer = [word for word in page if word.modifiedTime > modifiedTime]
+                words.extend(newer)
+                offset += len(page)
+                if len(newer) < len(page) or not page or offset >= data['total']:
+                    logger.info(f'增量获取单词本({groupName}-{groupId}): {words}')
+                    return words, data['total']
+        except LoginExpired:
+            raise
+        except Exception as e:
+            logger.exception(f'网络异常{e}')
+            return None
+
+    def getPageSize(self, groupId) -> int:
+        return self._probePageSize(groupId)[0]
+
+    def _probePageSize(self, groupId) -> (int, dict):
+        """
+        Try the candidate page sizes from the largest on page 0 of the group, and take the first one the server accepts.
+        It becomes the shared `Youdao.pageSize` only when the group is larger than it (or the server capped it), which
+        proves the limit: a smaller group fits on one page whatever the limit, so the next group probes again.
+        :return: (page size for the group, data of its page 0, or None if it was not fetched)
+        """
+        with Youdao.pageSizeLock:
+            if Youdao.pageSize is not None:
+                return Youdao.pageSize, None
+            for limit in self.PAGE_SIZE_CANDIDATES:
+                try:
+                    data = self._getWords(groupId, limit=limit, offset=0)
+                except LoginExpired:
+                    raise
+                except Exception as e:
+                    logger.info(f'每页{limit}个不可用: {e}')
+                    continue
+                returned = len(data['itemList'])
+                if returned >= min(limit, data['total']):
+                    if data['total'] > limit:
+                        logger.info(f'每页单词数: {limit}')
+                        Youdao.pageSize = limit
+                    return limit, data
+                if returned > 0:
+                    logger.info(f'每页单词数被限制为: {returned}')
+                    Youdao.pageSize = returned
+                    return returned, data
+            return self.DEFAULT_PAGE_SIZE, None
+
+    def _getWords(self, groupId, limit: int, offset: int, **params) -> dict:
+        """:return: data of the wordbook/webapi/words response, with 'total' and 'itemList'"""
+        r = self.session.get(
+            self.wordsUrl,
+            timeout=self.timeout,
+            params=dict(bookId=groupId, limit=limit, offset=offset, **params)
+        )
+        if r.status_code in (401, 403) or 'account.youdao.com' in r.url:
+            self.forgetLoginState()
+            raise LoginExpired(f'code:{r.status_code} url:{r.url}')
+        r.raise_for_status()
+        rsp = r.json()
+        if rsp.get('code', 0) != 0:
+            raise ValueError(f"code:{rsp.get('code')} msg:{rsp.get('msg')}")
+        return rsp['data']
+
+    @staticmethod
+    def _toSimpleWord(item: dict) -> SimpleWord:
+        return SimpleWord(item['word'], item['trans'], modifiedTime=item['modifiedTime'], bookId=item['bookId'], bookName=item['bookName'])
 
     @classmethod
     def close(cls):
@@ -1,8 +1,18 @@
+import asyncio
+import hashlib
+import json
 import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from queue import Queue
-from threading import Thread
+from threading import Thread, Lock
 from abc import ABC, abstractmethod
 
+import requests.utils
+
+from .utils import normalize_term
+
 logger = logging.getLogger('dict2Anki.misc')
 
 
@@ -47,7 +57,34 @@ class SimpleWord(ABC):
         return self.term
 
 
+class LoginExpired(Exception):
+    """The dictionary rejected the session cookie (401 or a redirect to its login page)"""
+
+
 class AbstractDictionary(ABC):
+    loginStateTTL = 30 * 60     # seconds a verified cookie is trusted without checking it again
+    _verifiedCookies = {}       # (dictionary name, cookie hash) -> time the cookie was verified
+
+    def checkLoginState(self, cookie: dict) -> bool:
+        """`checkCookie`, skipped while a positive result for the same cookie is younger than `loginStateTTL`"""
+        key = (self.name, hashlib.sha256(json.dumps(cookie, sort_keys=True).encode()).hexdigest())
+        verified = AbstractDictionary._verifiedCookies.get(key)
+        if verified is not None and time.time() - verified < self.loginStateTTL:
+            logger.info('Cookie有效(缓存)')
+            self.useCookie(cookie)
+            return True
+        if self.checkCookie(cookie):
+            AbstractDictionary._verifiedCookies[key] = time.time()
+            return True
+        AbstractDictionary._verifiedCookies.pop(key, None)
+        return False
+
+    def forgetLoginState(self):
+        for key in [key for key in AbstractDictionary._verifiedCookies if key[0] == self.name]:
+            AbstractDictionary._verifiedCookies.pop(key, None)
+
+    def useCookie(self, cookie: dict):
+        self.session.cookies = requests.utils.cookiejar_from_dict(cookie, cookiejar=None, overwrite=True)
 
     @staticmethod
     @abstractmethod
@@ -70,23 +107,162 @@ class AbstractDictionary(ABC):
     def getWordsByPage(self, pageNo: int, groupName: str, groupId: str) -> [SimpleWord]:
         pass
 
+    def getFirstPage(self, groupName: str, groupId: str) -> ([SimpleWord], int):
+        """
+        获取第一页单词及总页数. Dictionaries whose page responses carry the total override this to save a request.
+        :return: (words of page 0, total pages). Total pages is None on errors.
+        """
+        totalPage = self.getTotalPage(groupName, groupId)
+        return (self.getWordsByPage(0, groupName, groupId) if totalPage else []), totalPage
+
+    def iterWords(self, groupName: str, groupId: str, prefetch=3, executor=None, onPageCount=None):
+        """
+        逐页获取: yield the words of a group page by page, in order, keeping up to `prefetch` pages in flight, so that
+        callers can use the first pages while later ones are still being fetched.
+        :param executor: pool to fetch the pages in, e.g. shared by several groups. A private one by default.
+        :param onPageCount: called with the total page count, once the first page has arrived
+        :raise ConnectionError: if the first page could not be fetched
+        """
+        firstPage, totalPage = self.getFirstPage(groupName, groupId)
+        if totalPage is None:
+            raise ConnectionError(f'获取单词本({groupName}-{groupId})失败')
+        if onPageCount:
+            onPageCount(totalPage)
+        yield firstPage
+
+        privateExecutor = executor is None and totalPage > 1
+        if privateExecutor:
+            executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque()
+        nextPage = 1
+        try:
+            while nextPage < totalPage or pending:
+                while nextPage < totalPage and len(pending) < prefetch:
+                    pending.append(executor.submit(self.getWordsByPage, nextPage, groupName, groupId))
+                    nextPage += 1
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if privateExecutor:
+                executor.shutdown(wait=True)
+
+    def getWordsSince(self, groupName: str, groupId: str, modifiedTime: int) -> ([SimpleWord], int):
+        """
+        增量获取: words added or modified after `modifiedTime`
+        :return: (words, total word count of the group), or None if not supported, in which case every page is pulled
+        """
+        return None
+
     @classmethod
     @abstractmethod
     def close(cls):
         pass
 
 
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: callers arriving while a call is in flight wait for it and share
+    its result (or exception) instead of repeating it."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self.deduplicated = 0
+
+    def _join(self, key) -> (Future, bool):
+        """:return: (Future of the call in flight, whether the caller leads it)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.deduplicated += 1
+        return call, leader
+
+    def _leave(self, key):
+        with self._lock:
+            del self._calls[key]
+
+    def do(self, key, fn, *args, **kwargs):
+        call, leader = self._join(key)
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+    async def doAsync(self, key, fn, *args, **kwargs):
+        """Same as `do` for a coroutine function `fn`. Followers await the call instead of blocking the event loop, and
+        calls are shared with `do` and with other event loops."""
+        call, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(call)
+
+        try:
+            result = await fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+
 class AbstractQueryAPI(ABC):
+    # shared by all APIs and callers, so that concurrent requests for the same term go out once
+    flight = SingleFlight()
+
     @classmethod
     @abstractmethod
-    def query(cls, word: SimpleWord) -> dict:
+    def query(cls, word: SimpleWord, fg=None) -> dict:
         """
         查询
         :param word: 单词
+        :param fg: FieldGroup. Sections toggled off in it are not parsed, and left empty in the result.
         :return: 查询结果 dict(term, definition, phrase, image, sentence, BrEPhonetic, AmEPhonetic, BrEPron, AmEPron)
         """
         pass
 
+    @classmethod
+    @abstractmethod
+    def buildRequest(cls, word: SimpleWord) -> str:
+        """:return: url to GET for querying the word"""
+        pass
+
+    @classmethod
+    @abstractmethod
+    def parseResponse(cls, text: str, word: SimpleWord, fg=None) -> dict:
+        """:return: 查询结果, same as `query`"""
+        pass
+
+    @classmethod
+    def fetch(cls, word: SimpleWord) -> str:
+        """
+        I/O half of `query`. Concurrent fetches of the same normalized term share one request.
+        :return: raw response text, or None if the request failed
+        """
+        return cls.flight.do((cls.name, normalize_term(word.term)), cls._fetch, word)
+
+    @classmethod
+    def _fetch(cls, word: SimpleWord) -> str:
+        try:
+            rsp = cls.session.get(cls.buildRequest(word), timeout=cls.timeout)
+            if rsp.status_code != 200:
+                logger.error(f'code:{rsp.status_code} term:{word.term} text:{rsp.text[:100]}')
+            return rsp.text
+        except Exception as e:
+            logger.exception(e)
+            return None
+
     @classmethod
     @abstractmethod
     def close(cls):
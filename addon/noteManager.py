@@ -1,10 +1,14 @@
 from .constants import *
+from . import utils
 import logging
+import time
 
 logger = logging.getLogger('dict2Anki.noteManager')
+FIELD_SEPARATOR = '\x1f'
 try:
     from aqt import mw
-    import anki
+    import anki.utils
+    from anki.collection import AddNoteRequest, OpChanges
 except ImportError:
     from test.dummy_aqt import mw
     from test import dummy_anki as anki
@@ -14,25 +18,82 @@ def getDeckList():
     return [deck['name'] for deck in mw.col.decks.all()]
 
 
+def getTermIndexByDeck(deckName) -> {str: [(int, str)]}:
+    """
+    Read the terms of the Dict2Anki notes in a deck (and its subdecks) with a single collection query,
+    without loading the notes themselves.
+    :return: {lower-cased term: [(nid, term)]}
+    """
+    did = mw.col.decks.id_for_name(deckName)
+    if did is None:
+        return {}
+    dids = anki.utils.ids2str(mw.col.decks.deck_and_child_ids(did))
+    termOrds = {}       # mid -> ord of the 'term' field
+    for nt in mw.col.models.all_names_and_ids():
+        if nt.name.lower().startswith('dict2anki'):
+            fieldMap = mw.col.models.field_map(mw.col.models.get(nt.id))
+            if 'term' in fieldMap:
+                termOrds[nt.id] = fieldMap['term'][0]
+    if not termOrds:
+        return {}
+    rows = mw.col.db.all(
+        f'SELECT DISTINCT n.id, n.mid, n.flds FROM notes n JOIN cards c ON c.nid = n.id '
+        f'WHERE (c.did IN {dids} OR c.odid IN {dids}) AND n.mid IN {anki.utils.ids2str(termOrds)}'
+    )
+    index = {}
+    for nid, mid, flds in rows:
+        term = flds.split(FIELD_SEPARATOR)[termOrds[mid]]
+        if term:
+            index.setdefault(term.lower(), []).append((nid, term))
+    return index
+
+
 def getWordsByDeck(deckName) -> [str]:
-    notes = mw.col.findNotes(f'deck:"{deckName}"')
-    words = []
-    for nid in notes:
-        note = mw.col.getNote(nid)
-        if note.model().get('name', '').lower().startswith('dict2anki') and note['term']:
-            words.append(note['term'])
-    return words
+    return [term for notes in getTermIndexByDeck(deckName).values() for nid, term in notes]
 
 
 def getNoteIDsOfWords(wordList, deckName) -> list:
+    """
+    Resolve terms to note ids against the term index of the deck, matching case-insensitively like
+    utils.set_sub_ignore_case. A note with the exact spelling is preferred over other casings.
+    """
+    index = getTermIndexByDeck(deckName)
     notes = []
+    seen = set()
     for word in wordList:
-        note = mw.col.findNotes(f'deck:"{deckName}" term:"{word}"')
-        if note:
-            notes.append(note[0])
+        matches = [(term != word, nid) for nid, term in index.get(word.lower(), []) if nid not in seen]
+        if matches:
+            nid = min(matches, key=lambda m: m[0])[1]
+            seen.add(nid)
+            notes.append(nid)
     return notes
 
 
+def findTermsWithMissingAssets(mediaFiles) -> [(str, str, str)]:
+    """
+    Dict2Anki notes whose image or pronunciation file is not in `mediaFiles` (e.g. a MediaIndex).
+    The fields of all notes are read with a single query instead of loading each note.
+    :return: (term, missing image filename, missing audio filename) of each note, '' when the file is not missing.
+             The filenames are the ones the fields reference, which are content-addressed when dedupeMedia is on.
+    """
+    start = time.perf_counter()
+    model = mw.col.models.byName(MODEL_NAME)
+    if not model:
+        return []
+    fieldMap = mw.col.models.field_map(model)
+    termOrd, imageOrd, pronOrd = (fieldMap[name][0] for name in ('term', 'image', 'pronunciation'))
+    rows = mw.col.db.all('SELECT flds FROM notes WHERE mid = ?', model['id'])
+    missing = []
+    for flds, in rows:
+        fields = flds.split(FIELD_SEPARATOR)
+        imageName = utils.get_image(fields[imageOrd]) if utils.is_image_file_missing(fields[imageOrd], mediaFiles) else ''
+        audioName = utils.get_audio(fields[pronOrd]) if utils.is_audio_file_missing(fields[pronOrd], mediaFiles) else ''
+        if imageName or audioName:
+            missing.append((fields[termOrd], imageName, audioName))
+    logger.info(f"检查 '{MODEL_NAME}' 笔记 {len(rows)} 条: 缺失图片或发音 {len(missing)}, 用时 {time.perf_counter() - start:.2f}s")
+    return missing
+
+
 def getOrCreateDeck(deckName, model):
     deck_id = mw.col.decks.id(deckName)
     deck = mw.col.decks.get(deck_id)
@@ -193,8 +254,8 @@ def resetModelCardTemplates(modelObject, fg):
 
 
 def setNoteFieldValue(note, key: str, value: str, isNewNote: bool, overwrite: bool) -> bool:
-    """set note field value. :return isWritten"""
-    if not value:
+    """set note field value. :return isWritten (False if the field already holds the value)"""
+    if not value or note[key] == value:
         return False
     if isNewNote or overwrite:
         note[key] = value
@@ -206,8 +267,25 @@ def setNoteFieldValue(note, key: str, value: str, isNewNote: bool, overwrite: bo
 
 
 def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existing_note=None, overwrite=False):
+    """Add (or update) a single note and write it to the collection right away. See buildNote for the parameters."""
+    note, modified = buildNote(deck, model, config, word, whichPron, existing_note, overwrite)
+    if not modified:
+        if note is not None:
+            logger.debug(f"笔记{word['term']}无变化, 跳过")
+        return
+    if existing_note is None:
+        mw.col.addNote(note)
+        logger.info(f"添加笔记{word['term']}")
+    else:
+        mw.col.update_note(note)
+        logger.info(f"更新笔记{word['term']}")
+    mw.col.reset()
+
+
+def buildNote(deck, model, config: dict, word: dict, whichPron: str, existing_note=None, overwrite=False,
+              mediaNames: dict = None):
     """
-    Add note
+    Build a new note, or fill an existing one, without writing it to the collection
     :param deck: deck
     :param model: model
     :param config: currentConfig
@@ -216,11 +294,13 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
     :param existing_note: if not None, then do not create new note
     :param overwrite: True to overwrite existing note, and False to fill missing values only. (Only relevant when
                         'existing_note' is not None.
-    :return: None
+    :param mediaNames: {default asset file name: file name in the MediaStore}, when assets are stored content-addressed
+    :return: (note, modified). note is None if the query result is invalid; modified is False if no field of an
+             existing note was changed, so it does not need to be written.
     """
     if not word:
         logger.warning(f'查询结果{word} 异常，忽略')
-        return
+        return None, False
 
     isNewNote = (existing_note is None)
     if isNewNote:
@@ -230,7 +310,8 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
         note = existing_note                    # existing note
 
     term = word['term']
-    setNoteFieldValue(note, 'term', term, isNewNote, overwrite)
+    modified = isNewNote
+    modified |= setNoteFieldValue(note, 'term', term, isNewNote, overwrite)
     # note['term'] = term
 
     # ================================== Required fields ==================================
@@ -240,29 +321,29 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
     # group (bookName)
     if word['bookName']:
         key, value = 'group', word['bookName']
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['group'] = word['bookName']
 
     # exam_type
     if word['exam_type']:       # [str]
         key, value = 'exam_type', " / ".join(word['exam_type'])
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['exam_type'] = " / ".join(word['exam_type'])
 
     # modifiedTime
     if word['modifiedTime']:    # int
         key, value = 'modifiedTime', str(word['modifiedTime'])
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['modifiedTime'] = str(word['modifiedTime'])
 
     # phonetic
     if word['BrEPhonetic']:
         key, value = 'uk', word['BrEPhonetic']
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['uk'] = word['BrEPhonetic']
     if word['AmEPhonetic']:
         key, value = 'us', word['AmEPhonetic']
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['us'] = word['AmEPhonetic']
 
     # definition
@@ -275,7 +356,7 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
         definitions = [word['definition_brief']] if word['definition_brief'] else word['definition']
 
     key, value = 'definition', '<br>\n'.join(definitions)
-    setNoteFieldValue(note, key, value, isNewNote, overwrite)
+    modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
     # note['definition'] = '<br>\n'.join(definitions)
 
     # ================================== Optional fields ==================================
@@ -286,32 +367,34 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
     # definition_en
     if word['definition_en']:
         key, value = 'definition_en', '<br>\n'.join(word['definition_en'])
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['definition_en'] = '<br>\n'.join(word['definition_en'])
 
     # image
     if word['image']:
         imageFilename = default_image_filename(term)
+        imageFilename = mediaNames.get(imageFilename, imageFilename) if mediaNames else imageFilename
         key, value = 'image', f'<div><img src="{imageFilename}" /></div>'
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['image'] = f'<div><img src="{imageFilename}" /></div>'
 
     # pronunciation
     if whichPron and whichPron != 'noPron' and word[whichPron]:
         pronFilename = default_audio_filename(term)
+        pronFilename = mediaNames.get(pronFilename, pronFilename) if mediaNames else pronFilename
         key, value = 'pronunciation', f"[sound:{pronFilename}]"
-        setNoteFieldValue(note, key, value, isNewNote, overwrite)
+        modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
         # note['pronunciation'] = f"[sound:{pronFilename}]"
 
     # phrase
     if word['phrase']:
         for i, phrase_tuple in enumerate(word['phrase'][:3]):       # at most 3 phrases
             key, value = f'phrase{i}', phrase_tuple[0]
-            setNoteFieldValue(note, key, value, isNewNote, overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
             key, value = f'phrase_explain{i}', phrase_tuple[1]
-            setNoteFieldValue(note, key, value, isNewNote, overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
             key, value = f'pplaceHolder{i}', "Tap To View"
-            setNoteFieldValue(note, key, value, isNewNote, overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, overwrite)
             # note[f'phrase{i}'], note[f'phrase_explain{i}'] = phrase_tuple
             # note[f'pplaceHolder{i}'] = "Tap To View"
 
@@ -326,20 +409,63 @@ def addNoteToDeck(deck, model, config: dict, word: dict, whichPron: str, existin
                 s_overwrite = True
 
             key, value = f'sentence{i}', sentence_tuple[0]
-            setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
             key, value = f'sentence_explain{i}', sentence_tuple[1]
-            setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
             key, value = f'splaceHolder{i}', "Tap To View"
-            setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
             key, value = f'sentence_speech{i}', sentence_tuple[2]
-            setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
+            modified |= setNoteFieldValue(note, key, value, isNewNote, s_overwrite)
             # note[f'sentence{i}'], note[f'sentence_explain{i}'] = sentence_tuple
             # note[f'splaceHolder{i}'] = "Tap To View"
 
-    if isNewNote:
-        mw.col.addNote(note)
-        logger.info(f"添加笔记{term}")
-    else:
-        mw.col.update_note(note)
-        logger.info(f"更新笔记{term}")
-    mw.col.reset()
+    return note, modified
+
+
+def fillMissingValues(config: dict, words: [(dict, str, object)]) -> (list, int):
+    """
+    Fill the missing field values of existing notes, see buildNote
+    :param words: [(query result, whichPron, existing note)]
+    :return: (modified notes, number of notes skipped as unchanged)
+    """
+    notes = [buildNote(None, None, config, word, whichPron, existing_note, False) for word, whichPron, existing_note in words]
+    updatedNotes = [note for note, modified in notes if modified]
+    return updatedNotes, sum(1 for note, modified in notes if note is not None and not modified)
+
+
+def writeNotes(newNotes: [(object, int)], updatedNotes: list, undoName='Dict2Anki', chunkSize=NOTE_WRITE_CHUNK_SIZE,
+               onProgress=lambda done, total: None, isCancelled=lambda: False) -> (int, int, object):
+    """
+    Write notes built by buildNote in chunks, as a single undoable operation. The caller resets the GUI once afterwards.
+    Safe to run in a CollectionOp.
+    :param newNotes: [(note, deck id)]
+    :param updatedNotes: existing notes
+    :param onProgress: called with (written, total) after each chunk
+    :param isCancelled: checked before each chunk. Chunks written so far are kept, and can be undone together.
+    :return: (added, updated, OpChanges)
+    """
+    start = time.perf_counter()
+    total = len(newNotes) + len(updatedNotes)
+    added, updated = 0, 0
+    changes = OpChanges()
+    if not total:
+        return added, updated, changes      # no empty step in Anki's undo menu
+    undoEntry = mw.col.add_custom_undo_entry(undoName)
+    chunks = [(True, newNotes[i:i + chunkSize]) for i in range(0, len(newNotes), chunkSize)] + \
+             [(False, updatedNotes[i:i + chunkSize]) for i in range(0, len(updatedNotes), chunkSize)]
+    for isNew, chunk in chunks:
+        if isCancelled():
+            logger.warning(f'写入笔记已取消: {added + updated}/{total}')
+            break
+        if isNew:
+            mw.col.add_notes([AddNoteRequest(note, deck_id=did) for note, did in chunk])
+            added += len(chunk)
+        else:
+            mw.col.update_notes(chunk)
+            updated += len(chunk)
+        changes = mw.col.merge_undo_entries(undoEntry)
+        onProgress(added + updated, total)
+    elapsed = time.perf_counter() - start
+    logger.info(f'写入笔记: 新增 {added}, 更新 {updated}, 用时 {elapsed:.2f}s '
+                f'({(added + updated) / elapsed if elapsed else 0:.0f} 条/秒)')
+    return added, updated, changes
@@ -2,17 +2,55 @@ import logging
 import requests
 from urllib3 import Retry
 from requests.adapters import HTTPAdapter
-from ..constants import HEADERS
+from ..constants import HEADERS, FieldGroup
 from ..misc import AbstractQueryAPI, SimpleWord
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+try:
+    import lxml  # noqa: F401
+    HTML_BUILDER = 'lxml'
+except ImportError:
+    HTML_BUILDER = 'html.parser'
 logger = logging.getLogger('dict2Anki.queryApi.eudict')
 __all__ = ['API']
 
 
+class SectionStrainer(SoupStrainer):
+    """
+    Only build the page sections read by Parser, skipping the navigation, ads and scripts around them.
+    Implements both the bs4 < 4.13 (`search_tag`) and the bs4 >= 4.13 (`allow_tag_creation`) strainer interfaces.
+    """
+    IDS = {'ExpFCChild', 'ExpSPECChild', 'ExpLJChild'}
+    CLASSES = {'phonitic-line', 'word-thumbnail-container', 'gv_details'}
+
+    def _wanted(self, attrs) -> bool:
+        if not attrs:
+            return False
+        if attrs.get('id') in self.IDS:
+            return True
+        classes = attrs.get('class') or ''
+        if isinstance(classes, str):
+            classes = classes.split()
+        return not self.CLASSES.isdisjoint(classes)
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        return self._wanted(markup_attrs)
+
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        return self._wanted(attrs)
+
+    def allow_string_creation(self, string) -> bool:
+        return False
+
+
+STRAINER = SectionStrainer()
+
+
 class Parser:
-    def __init__(self, html, word: SimpleWord):
-        self._soap = BeautifulSoup(html, 'html.parser')
+    def __init__(self, html, word: SimpleWord, fg: FieldGroup = None):
+        self._soap = BeautifulSoup(html, HTML_BUILDER, parse_only=STRAINER)
         self.word = word
+        self.fg = fg
+        self._pronunciations = None
 
     @staticmethod
     def __fix_url_without_http(url):
@@ -24,7 +62,7 @@ class Parser:
     @property
     def definition(self) -> list:
         ret = []
-        div = self._soap.select('div #ExpFCChild')
+        div = self._soap.select('#ExpFCChild')
         if not div:
             return ret
 
@@ -55,7 +93,7 @@ class Parser:
 
     @property
     def phrase(self) -> list:
-        els = self._soap.select('div #ExpSPECChild #phrase')
+        els = self._soap.select('#ExpSPECChild #phrase')
         ret = []
         for el in els:
             try:
@@ -68,7 +106,7 @@ class Parser:
 
     @property
     def sentence(self) -> list:
-        els = self._soap.select('div #ExpLJChild .lj_item')
+        els = self._soap.select('#ExpLJChild .lj_item')
         ret = []
         for el in els:
             try:
@@ -83,7 +121,7 @@ class Parser:
 
     @property
     def image(self) -> str:
-        els = self._soap.select('div .word-thumbnail-container img')
+        els = self._soap.select('.word-thumbnail-container img')
         ret = None
         if els:
             try:
@@ -96,6 +134,11 @@ class Parser:
 
     @property
     def pronunciations(self) -> dict:
+        if self._pronunciations is None:
+            self._pronunciations = self._parsePronunciations()
+        return self._pronunciations
+
+    def _parsePronunciations(self) -> dict:
         url = 'https://api.frdic.com/api/v2/speech/speakweb?'
         pron = {
             'AmEPhonetic': None,
@@ -114,7 +157,7 @@ class Parser:
 
         if not links:
             # 可能是只有一个发音的情况
-            links = self._soap.select('div .gv_details .voice-button')
+            links = self._soap.select('.gv_details .voice-button')
             # 返回两个相同的。下载只会按照用户选择下载一个，这样至少可以保证总是有发音
             links = [links[0], links[0]] if links else ''
 
@@ -171,8 +214,15 @@ class Parser:
         # TODO
         return []
 
+    def section(self, name, empty):
+        """Parse the section on demand, only if it is enabled in the FieldGroup"""
+        if self.fg is None or self.fg.isEnabled(name):
+            return getattr(self, name)
+        return empty
+
     @property
     def result(self):
+        pron = self.pronunciations
         return {
             'term': self.word.term,
             'bookId': self.word.bookId,
@@ -181,15 +231,15 @@ class Parser:
             'definition_brief': self.word.trans,
 
             'definition': self.definition,
-            'definition_en': self.definition_en,
-            'phrase': self.phrase,
-            'sentence': self.sentence,
-            'image': self.image,
-            'BrEPhonetic': self.BrEPhonetic,
-            'AmEPhonetic': self.AmEPhonetic,
-            'BrEPron': self.BrEPron,
-            'AmEPron': self.AmEPron,
-            'exam_type': self.exam_type,
+            'definition_en': self.section('definition_en', []),
+            'phrase': self.section('phrase', []),
+            'sentence': self.section('sentence', []),
+            'image': self.section('image', None),
+            'BrEPhonetic': pron['BrEPhonetic'],
+            'AmEPhonetic': pron['AmEPhonetic'],
+            'BrEPron': pron['BrEUrl'],
+            'AmEPron': pron['AmEUrl'],
+            'exam_type': self.section('exam_type', []),
         }
 
 
@@ -205,12 +255,20 @@ class API(AbstractQueryAPI):
     parser = Parser
 
     @classmethod
-    def query(cls, word) -> dict:
+    def buildRequest(cls, word: SimpleWord) -> str:
+        return cls.url.format(word.term)
+
+    @classmethod
+    def parseResponse(cls, text: str, word: SimpleWord, fg: FieldGroup = None) -> dict:
+        return cls.parser(text, word, fg).result
+
+    @classmethod
+    def query(cls, word, fg: FieldGroup = None) -> dict:
         queryResult = None
         try:
-            rsp = cls.session.get(cls.url.format(word.term), timeout=cls.timeout)
-            logger.debug(f'code:{rsp.status_code}- word:{word.term} text:{rsp.text[:100]}')
-            queryResult = cls.parser(rsp.text, word).result
+            text = cls.fetch(word)
+            if text is not None:
+                queryResult = cls.parseResponse(text, word, fg)
         except Exception as e:
             logger.exception(e)
         finally:
@@ -4,134 +4,183 @@ import requests
 from urllib3 import Retry
 from urllib.parse import urlencode
 from requests.adapters import HTTPAdapter
-from ..constants import HEADERS
+from ..constants import HEADERS, FieldGroup
 from ..misc import AbstractQueryAPI, SimpleWord
 
 logger = logging.getLogger('dict2Anki.queryApi.youdao')
 __all__ = ['API']
 SENTENCE_SPEECH_URL_PREFIX = "http://dict.youdao.com/dictvoice?audio="
+PRON_URL_PREFIX = "http://dict.youdao.com/dictvoice?audio="
+
+
+class Entry:
+    """Fields extracted from a jsonapi payload"""
+    __slots__ = ('definition', 'web_trans', 'definition_en', 'phrase', 'sentence', 'image', 'exam_type',
+                 'AmEPhonetic', 'AmEUrl', 'BrEPhonetic', 'BrEUrl')
+
+    def __init__(self):
+        self.definition = []
+        self.web_trans = []
+        self.definition_en = []
+        self.phrase = []
+        self.sentence = []
+        self.image = None
+        self.exam_type = []
+        self.AmEPhonetic = None
+        self.AmEUrl = None
+        self.BrEPhonetic = None
+        self.BrEUrl = None
+
+
+def _extract_ec(entry: Entry, ec: dict):
+    """中文释义, 考试类型"""
+    try:
+        entry.definition = [d['tr'][0]['l']['i'][0] for d in ec['word'][0]['trs'][:3]]
+    except (KeyError, IndexError, TypeError):
+        entry.definition = []
+    entry.exam_type = ec.get('exam_type', [])
+
+
+def _extract_web_trans(entry: Entry, web_trans: dict):
+    entry.web_trans = [w['value'] for w in web_trans['web-translation'][0]['trans'][:3]]
+
+
+def _extract_ee(entry: Entry, ee: dict):
+    """英英释义"""
+    entry.definition_en = [d['pos'] + ' ' + d['tr'][0]['l']['i'] for d in ee['word']['trs'][:3]]
+
+
+def _extract_phrs(entry: Entry, phrs: dict):
+    phrase = []
+    for p in phrs.get('phrs', [])[:3]:
+        phr = p.get('phr', dict())
+        phrase.append((
+            phr.get('headword', dict()).get('l', dict()).get('i', None),
+            phr.get('trs', [dict()])[0].get('tr', dict()).get('l', dict()).get('i', None)
+        ))
+    entry.phrase = phrase
+
+
+def _extract_blng_sents_part(entry: Entry, blng_sents_part: dict):
+    entry.sentence = [
+        (s['sentence-eng'], s['sentence-translation'], SENTENCE_SPEECH_URL_PREFIX + s['sentence-speech'])
+        for s in blng_sents_part['sentence-pair'][:3]
+    ]
+
+
+def _extract_pic_dict(entry: Entry, pic_dict: dict):
+    entry.image = pic_dict['pic'][0]['image']
+
+
+def _extract_simple(entry: Entry, simple: dict):
+    word = simple['word'][0]
+    entry.AmEPhonetic = word.get('usphone')
+    entry.BrEPhonetic = word.get('ukphone')
+    if isinstance(word.get('usspeech'), str):
+        entry.AmEUrl = PRON_URL_PREFIX + word['usspeech']
+    if isinstance(word.get('ukspeech'), str):
+        entry.BrEUrl = PRON_URL_PREFIX + word['ukspeech']
+
+
+# payload key -> (card section it belongs to (None if always needed), extractor)
+EXTRACTORS = {
+    'ec': (None, _extract_ec),
+    'web_trans': (None, _extract_web_trans),
+    'ee': ('definition_en', _extract_ee),
+    'phrs': ('phrase', _extract_phrs),
+    'blng_sents_part': ('sentence', _extract_blng_sents_part),
+    'pic_dict': ('image', _extract_pic_dict),
+    'simple': (None, _extract_simple),
+}
 
 
 class Parser:
-    def __init__(self, json_obj, word: SimpleWord):
-        self._result = json_obj
+    """Walks the jsonapi payload once, and only extracts the sections enabled in the FieldGroup"""
+
+    def __init__(self, json_obj, word: SimpleWord, fg: FieldGroup = None):
         self.word = word
+        self.fg = fg
+        self._entry = self._extract(json_obj)
+
+    def _extract(self, json_obj: dict) -> Entry:
+        entry = Entry()
+        for key, value in json_obj.items():
+            extractor = EXTRACTORS.get(key)
+            if extractor is None:
+                continue
+            section, extract = extractor
+            if section and self.fg is not None and not self.fg.isEnabled(section):
+                continue
+            try:
+                extract(entry, value)
+            except (KeyError, IndexError, TypeError, AttributeError):
+                pass
+        if self.fg is not None and not self.fg.isEnabled('exam_type'):
+            entry.exam_type = []
+        # if no audio, then set a default one
+        if not (entry.AmEUrl or entry.BrEUrl):
+            entry.AmEUrl = f"{PRON_URL_PREFIX}{self.word.term}&type=2"
+            entry.BrEUrl = f"{PRON_URL_PREFIX}{self.word.term}&type=1"
+        return entry
 
     @property
     def definition(self) -> list:
         """中文释义"""
-        # print(json.dumps(self._result, ensure_ascii=False))
-        try:
-            ec = [d['tr'][0]['l']['i'][0] for d in self._result['ec']['word'][0]['trs']][:3]
-        except KeyError:
-            ec = []
-        # Web trans
-        try:
-            web_trans = [w['value'] for w in self._result['web_trans']['web-translation'][0]['trans']][:3]
-        except KeyError:
-            web_trans = []
-        return ec if ec else web_trans
+        return self._entry.definition or self._entry.web_trans
 
     @property
     def definition_en(self) -> list:
         """英英释义"""
-        try:
-            ee = [d['pos'] + ' ' + d['tr'][0]['l']['i'] for d in self._result['ee']['word']['trs']][:3]
-        except KeyError:
-            ee = []
-        return ee
+        return self._entry.definition_en
 
     @property
     def phrase(self) -> list:
-        phrase = self._result.get('phrs', dict()).get('phrs', [])
-        return [
-            (
-                p.get('phr', dict()).get('headword', dict()).get('l', dict()).get('i', None),
-                p.get('phr', dict()).get('trs', [dict()])[0].get('tr', dict()).get('l', dict()).get('i', None)
-            )
-            for p in phrase if phrase
-        ][:3]
+        return self._entry.phrase
 
     @property
     def sentence(self) -> list:
-        try:
-            return [(s['sentence-eng'], s['sentence-translation'], SENTENCE_SPEECH_URL_PREFIX + s['sentence-speech']) for s in self._result['blng_sents_part']['sentence-pair']][:3]
-        except KeyError:
-            return []
+        return self._entry.sentence
 
     @property
     def image(self) -> str:
-        try:
-            return [i['image'] for i in self._result['pic_dict']['pic']][0]
-        except (KeyError, IndexError):
-            return None
+        return self._entry.image
 
     @property
     def pronunciations(self) -> dict:
-        url = 'http://dict.youdao.com/dictvoice?audio='
-        pron = {
-            'AmEPhonetic': None,
-            'AmEUrl': None,
-            'BrEPhonetic': None,
-            'BrEUrl': None
+        return {
+            'AmEPhonetic': self._entry.AmEPhonetic,
+            'AmEUrl': self._entry.AmEUrl,
+            'BrEPhonetic': self._entry.BrEPhonetic,
+            'BrEUrl': self._entry.BrEUrl
         }
-        try:
-            pron['AmEPhonetic'] = self._result['simple']['word'][0]['usphone']
-        except KeyError:
-            pass
-
-        try:
-            pron['BrEPhonetic'] = self._result['simple']['word'][0]['ukphone']
-        except KeyError:
-            pass
-
-        try:
-            pron['AmEUrl'] = url + self._result['simple']['word'][0]['usspeech']
-        except (TypeError, KeyError):
-            pass
-
-        try:
-            pron['BrEUrl'] = url + self._result['simple']['word'][0]['ukspeech']
-        except (TypeError, KeyError):
-            pass
-
-        # if no audio, then set a default one
-        if not (pron['AmEUrl'] or pron['BrEUrl']):
-            pron['AmEUrl'] = f"{url}{self.word.term}&type=2"
-            pron['BrEUrl'] = f"{url}{self.word.term}&type=1"
-
-        return pron
 
     @property
     def BrEPhonetic(self) -> str:
         """英式音标"""
-        return self.pronunciations['BrEPhonetic']
+        return self._entry.BrEPhonetic
 
     @property
     def AmEPhonetic(self) -> str:
         """美式音标"""
-        return self.pronunciations['AmEPhonetic']
+        return self._entry.AmEPhonetic
 
     @property
     def BrEPron(self) -> str:
         """英式发音url"""
-        return self.pronunciations['BrEUrl']
+        return self._entry.BrEUrl
 
     @property
     def AmEPron(self) -> str:
         """美式发音url"""
-        return self.pronunciations['AmEUrl']
+        return self._entry.AmEUrl
 
     @property
     def exam_type(self) -> list:
-        try:
-            exam_t = self._result['ec']['exam_type']
-        except KeyError as err:
-            exam_t = []
-        return exam_t
+        return self._entry.exam_type
 
     @property
     def result(self):
+        entry = self._entry
         return {
             'term': self.word.term,
             'bookId': self.word.bookId,
@@ -139,16 +188,16 @@ class Parser:
             'modifiedTime': self.word.modifiedTime,
             'definition_brief': self.word.trans,
 
-            'definition': self.definition,
-            'definition_en': self.definition_en,
-            'phrase': self.phrase,
-            'sentence': self.sentence,
-            'image': self.image,
-            'BrEPhonetic': self.BrEPhonetic,
-            'AmEPhonetic': self.AmEPhonetic,
-            'BrEPron': self.BrEPron,
-            'AmEPron': self.AmEPron,
-            'exam_type': self.exam_type,
+            'definition': entry.definition or entry.web_trans,
+            'definition_en': entry.definition_en,
+            'phrase': entry.phrase,
+            'sentence': entry.sentence,
+            'image': entry.image,
+            'BrEPhonetic': entry.BrEPhonetic,
+            'AmEPhonetic': entry.AmEPhonetic,
+            'BrEPron': entry.BrEUrl,
+            'AmEPron': entry.AmEUrl,
+            'exam_type': entry.exam_type,
         }
 
 
@@ -165,14 +214,20 @@ class API(AbstractQueryAPI):
     parser = Parser
 
     @classmethod
-    def query(cls, word: SimpleWord) -> dict:
+    def buildRequest(cls, word: SimpleWord) -> str:
+        return f"{cls.url}?{urlencode(dict(cls.params, **{'q': word.term}))}"
+
+    @classmethod
+    def parseResponse(cls, text: str, word: SimpleWord, fg: FieldGroup = None) -> dict:
+        return cls.parser(json.loads(text), word, fg).result
+
+    @classmethod
+    def query(cls, word: SimpleWord, fg: FieldGroup = None) -> dict:
         queryResult = None
         try:
-            rsp = cls.session.get(cls.url, params=urlencode(dict(cls.params, **{'q': word.term})), timeout=cls.timeout)
-            logger.debug(f'code:{rsp.status_code} term:{word.term} text:{rsp.text}')
-            if rsp.status_code != 200:
-                logger.error(f'code:{rsp.status_code} term:{word.term} text:{rsp.text}')
-            queryResult = cls.parser(rsp.json(), word).result
+            text = cls.fetch(word)
+            if text is not None:
+                queryResult = cls.parseResponse(text, word, fg)
         except Exception as e:
             logger.exception(e)
         finally:
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from .constants import FieldGroup
+from .misc import SimpleWord
+from .utils import normalize_term
+
+logger = logging.getLogger('dict2Anki.queryCache')
+
+# word metadata comes from the wordbook rather than the dictionary, so it is not cached
+WORD_METADATA_KEYS = ('term', 'bookId', 'bookName', 'modifiedTime', 'definition_brief')
+# sections that were toggled off (hence not parsed) when the result was cached
+SKIPPED_KEY = '_skipped'
+
+
+def withWordMetadata(result: dict, word: SimpleWord) -> dict:
+    """Overwrite the word metadata of a query result with that of `word`"""
+    result.update(
+        term=word.term,
+        bookId=word.bookId,
+        bookName=word.bookName,
+        modifiedTime=word.modifiedTime,
+        definition_brief=word.trans,
+    )
+    return result
+
+
+class QueryCache:
+    """SQLite backed cache of query results, keyed by (api name, normalized term)."""
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 50000):
+        """
+        :param path: sqlite database file
+        :param ttl: seconds an entry stays valid
+        :param max_entries: least recently used entries are evicted beyond this size
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = False
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = Lock()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS query_cache ('
+            'api TEXT NOT NULL, term TEXT NOT NULL, result TEXT NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL, '
+            'PRIMARY KEY (api, term))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS query_cache_accessed ON query_cache (accessed)')
+        self._conn.commit()
+
+    def get(self, apiName: str, word: SimpleWord, fg: FieldGroup = None):
+        """
+        :param fg: FieldGroup of the query. Entries missing any of its enabled sections count as misses.
+        :return: cached query result of the word, or None on miss (or when bypassed)
+        """
+        if self.bypass:
+            return None
+        key = normalize_term(word.term)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result, created FROM query_cache WHERE api = ? AND term = ?', (apiName, key)
+            ).fetchone()
+            result = json.loads(row[0]) if row is not None and now - row[1] <= self.ttl else None
+            disabled = fg.disabled if fg else set()
+            if result is None or not set(result.pop(SKIPPED_KEY, [])) <= disabled:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE query_cache SET accessed = ? WHERE api = ? AND term = ?', (now, apiName, key))
+            self._conn.commit()
+            self.hits += 1
+        return withWordMetadata(result, word)
+
+    def put(self, apiName: str, word: SimpleWord, result: dict, fg: FieldGroup = None):
+        """Store a query result. Empty results (e.g. API anomalies) are not cached."""
+        if not result or not result.get('definition'):
+            return
+        value = {k: v for k, v in result.items() if k not in WORD_METADATA_KEYS}
+        value[SKIPPED_KEY] = sorted(fg.disabled) if fg else []
+        value = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO query_cache (api, term, result, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (apiName, normalize_term(word.term), value, now, now)
+            )
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used entries beyond `max_entries`. Caller holds the lock."""
+        self._conn.execute('DELETE FROM query_cache WHERE created < ?', (time.time() - self.ttl,))
+        count = self._conn.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM query_cache WHERE rowid IN (SELECT rowid FROM query_cache ORDER BY accessed LIMIT ?)',
+                (count - self.max_entries,)
+            )
+        self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM query_cache')
+            self._conn.commit()
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> str:
+        return f'hits={self.hits}, misses={self.misses}'
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Condition
+
+import requests
+from urllib3 import Retry
+from requests.adapters import HTTPAdapter
+
+from .constants import HEADERS
+from .misc import SimpleWord
+from .utils import normalize_term
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger('dict2Anki.queryEngine')
+
+
+def _parse(api, text: str, word: SimpleWord, fg) -> dict:
+    """Module level, so that it can be sent to worker processes"""
+    return api.parseResponse(text, word, fg)
+
+
+class ParseStage:
+    """
+    CPU-bound stage of the query pipeline, turning fetched responses into query results.
+    Parses in the calling thread by default. With `processes` > 0 parsing runs in a process pool instead, so that it is
+    not serialized by the GIL; if the pool breaks (e.g. processes cannot be spawned), it falls back to parsing inline.
+    """
+
+    def __init__(self, api, fg=None, processes=0):
+        self.api = api
+        self.fg = fg
+        self.executor = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+
+    def submit(self, text: str, word: SimpleWord) -> Future:
+        """:return: Future of the query result. Parse errors are logged and resolve to None."""
+        if self.executor is not None:
+            try:
+                future = Future()
+                self.executor.submit(_parse, self.api, text, word, self.fg).add_done_callback(
+                    lambda f: self._resolve(future, f, text, word))
+                return future
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f'解析进程池不可用, 改为线程内解析: {e}')
+                self.executor = None
+        future = Future()
+        future.set_result(self.parse(text, word))
+        return future
+
+    def _resolve(self, future: Future, done: Future, text: str, word: SimpleWord):
+        try:
+            future.set_result(done.result())
+        except BrokenProcessPool:
+            future.set_result(self.parse(text, word))
+        except Exception as e:
+            logger.exception(e)
+            future.set_result(None)
+
+    def parse(self, text: str, word: SimpleWord) -> dict:
+        try:
+            return _parse(self.api, text, word, self.fg)
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    def close(self):
+        """Blocks until all submitted responses are parsed"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+class AsyncQueryEngine:
+    """
+    Query words concurrently on a single asyncio event loop.
+    Uses aiohttp when it is available; otherwise the blocking `api.fetch` calls are run in a thread pool of the same
+    size, so the engine keeps working inside a plain Anki installation. Responses are parsed by `parseStage`.
+    """
+
+    def __init__(self, api, concurrency=16, fg=None, parseStage: ParseStage = None):
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self.fg = fg
+        self.parseStage = parseStage or ParseStage(api, fg)
+
+    def run(self, wordList: [(SimpleWord, int)], onSuccess, onFailure, isInterrupted=lambda: False):
+        """
+        Blocks until all words are queried.
+        :param onSuccess: called with (word, row, queryResult)
+        :param onFailure: called with (word, row)
+        :param isInterrupted: no more queries are started once it returns True
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._run(wordList, onSuccess, onFailure, isInterrupted))
+        finally:
+            loop.close()
+
+    async def _run(self, wordList, onSuccess, onFailure, isInterrupted):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _query(fetch, word, row):
+            async with semaphore:
+                if isInterrupted():
+                    return
+                queryResult = await fetch(word)
+            if queryResult:
+                onSuccess(word, row, queryResult)
+            else:
+                onFailure(word, row)
+
+        if aiohttp is not None:
+            timeout = aiohttp.ClientTimeout(total=self.api.timeout)
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            async with aiohttp.ClientSession(headers=HEADERS, timeout=timeout, connector=connector) as session:
+                fetch = self._aiohttpFetcher(session)
+                await asyncio.gather(*[_query(fetch, word, row) for word, row in wordList])
+        else:
+            logger.info('aiohttp is not available, falling back to thread based requests')
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                fetch = self._executorFetcher(executor)
+                await asyncio.gather(*[_query(fetch, word, row) for word, row in wordList])
+
+    def _aiohttpFetcher(self, session):
+        async def get(word: SimpleWord) -> str:
+            try:
+                async with session.get(self.api.buildRequest(word)) as rsp:
+                    text = await rsp.text()
+                    if rsp.status != 200:
+                        logger.error(f'code:{rsp.status} term:{word.term} text:{text[:100]}')
+                    return text
+            except Exception as e:
+                logger.exception(e)
+                return None
+
+        async def fetch(word: SimpleWord) -> dict:
+            # coalesced with the concurrent queries of the same term, like `api.fetch`
+            text = await self.api.flight.doAsync((self.api.name, normalize_term(word.term)), get, word)
+            if text is None:
+                return None
+            return await asyncio.wrap_future(self.parseStage.submit(text, word))
+        return fetch
+
+    def _executorFetcher(self, executor):
+        async def fetch(word: SimpleWord) -> dict:
+            text = await asyncio.get_running_loop().run_in_executor(executor, self.api.fetch, word)
+            if text is None:
+                return None
+            return await asyncio.wrap_future(self.parseStage.submit(text, word))
+        return fetch
+
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease limit of in-flight queries.
+    The limit grows by one after `limit` consecutive healthy responses, and is cut by `decreaseFactor` on 429/5xx,
+    network errors, or when the p95 latency of the recent window rises above `latencyFactor` times the best p95 seen.
+    """
+
+    def __init__(self, initial=3, minimum=1, maximum=16, decreaseFactor=0.5, latencyFactor=2.0, window=50, cooldown=1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.decreaseFactor = decreaseFactor
+        self.latencyFactor = latencyFactor
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.completed = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=window)
+        self._bestP95 = None
+        self._successes = 0
+        self._lastDecrease = 0
+        self._cond = Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= self.limit:
+                self._cond.wait()
+            self.inflight += 1
+
+    def release(self, latency: float, ok: bool):
+        """
+        :param latency: seconds the request took
+        :param ok: False on 429/5xx or network errors
+        """
+        with self._cond:
+            self.inflight -= 1
+            self.completed += 1
+            if not ok:
+                self.errors += 1
+                self._decrease()
+            else:
+                self._latencies.append(latency)
+                p95 = self.p95()
+                if len(self._latencies) == self._latencies.maxlen:
+                    if self._bestP95 is None or p95 < self._bestP95:
+                        self._bestP95 = p95
+                    elif p95 > self._bestP95 * self.latencyFactor:
+                        self._decrease()
+                        self._latencies.clear()
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._lastDecrease < self.cooldown:
+            return
+        self._lastDecrease = now
+        self._successes = 0
+        self.limit = max(self.minimum, int(self.limit * self.decreaseFactor))
+
+    def _percentile(self, q) -> float:
+        if not self._latencies:
+            return 0
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    def p50(self) -> float:
+        return self._percentile(0.5)
+
+    def p95(self) -> float:
+        return self._percentile(0.95)
+
+    def stats(self) -> str:
+        return (f'并发上限={self.limit}, 进行中={self.inflight}, p50={self.p50() * 1000:.0f}ms, '
+                f'p95={self.p95() * 1000:.0f}ms, 错误={self.errors}/{self.completed}')
+
+
+class AdaptiveQueryEngine:
+    """
+    Query words in threads, with concurrency driven by an AIMDController.
+    Uses its own session without status retries, so that server slowdowns reach the controller instead of stalling in
+    urllib3 backoffs. Words that got 429/5xx are retried (up to `maxRetry` times) once the limit has been lowered.
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, api, controller: AIMDController = None, maxRetry=2, reportInterval=5, fg=None,
+                 parseStage: ParseStage = None):
+        self.api = api
+        self.fg = fg
+        self.parseStage = parseStage or ParseStage(api, fg)
+        self.controller = controller or AIMDController()
+        self.maxRetry = maxRetry
+        self.reportInterval = reportInterval
+        self.session = requests.Session()
+        self.session.headers = HEADERS
+        adapter = HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[]),
+                              pool_maxsize=self.controller.maximum)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lastReport = 0
+
+    def run(self, wordList: [(SimpleWord, int)], onSuccess, onFailure, isInterrupted=lambda: False):
+        """Same as AsyncQueryEngine.run"""
+        def _query(word: SimpleWord, row):
+            queryResult = None
+            for i in range(self.maxRetry + 1):
+                if isInterrupted():
+                    return
+                queryResult, retry = self._fetch(word)
+                if not retry:
+                    break
+                logger.info(f'Retrying {word} ({i + 1})')
+            if queryResult:
+                onSuccess(word, row, queryResult)
+            else:
+                onFailure(word, row)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.controller.maximum) as executor:
+                for (word, row) in wordList:
+                    executor.submit(_query, word, row)
+        finally:
+            self.session.close()
+        logger.info(self.controller.stats())
+
+    def _fetch(self, word: SimpleWord) -> (dict, bool):
+        """:return: (queryResult, shouldRetry)"""
+        # coalesced with the concurrent queries of the same term, like `api.fetch`
+        text = self.api.flight.do((self.api.name, normalize_term(word.term)), self._get, word)
+        if text is None:
+            return None, True
+        return self.parseStage.submit(text, word).result(), False
+
+    def _get(self, word: SimpleWord) -> str:
+        """:return: response text, or None on 429/5xx and network errors, which are worth a retry"""
+        self.controller.acquire()
+        start = time.monotonic()
+        status, text = None, None
+        try:
+            rsp = self.session.get(self.api.buildRequest(word), timeout=self.api.timeout)
+            status, text = rsp.status_code, rsp.text
+        except Exception as e:
+            logger.warning(f'查询{word}异常: {e}')
+        finally:
+            self.controller.release(time.monotonic() - start, ok=status is not None and status not in self.RETRY_STATUS)
+            self._report()
+
+        if status is None or status in self.RETRY_STATUS:
+            if status:
+                logger.warning(f'code:{status} term:{word.term}')
+            return None
+        return text
+
+    def _report(self):
+        now = time.monotonic()
+        if now - self._lastReport >= self.reportInterval:
+            self._lastReport = now
+            logger.info(self.controller.stats())
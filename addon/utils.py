@@ -1,8 +1,11 @@
-import os
+import html
 import re
 from pathlib import Path
 
-from bs4 import BeautifulSoup
+
+def normalize_term(term: str) -> str:
+    """Trim and collapse whitespaces, so that the same term always maps to the same key"""
+    return re.sub(r'\s+', ' ', term.strip())
 
 
 def set_sub_ignore_case(a, b: set) -> set:
@@ -10,35 +13,52 @@ def set_sub_ignore_case(a, b: set) -> set:
     return {v for v in a if v.lower() not in b_lower}
 
 
+# field values are read in bulk when scanning for missing assets, so avoid building a soup for each of them
+IMAGE_SRC_RE = re.compile(r'''<img\b[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+SOUND_RE = re.compile(r'\[sound:(.+?)]')
+
+
+def merge_watermarks(stored: dict, pending: dict, local_count: int, unresolved_deletions: int) -> dict:
+    """
+    Watermarks to store after a sync, see RemoteWordFetchingWorker.
+    While local words that are gone remotely are kept (deletion candidates left unchecked), the pulled groups lose their
+    watermarks: an incremental pull would never offer those words for deletion again.
+    """
+    watermarks = dict(stored)
+    for key, watermark in pending.items():
+        if unresolved_deletions:
+            watermarks.pop(key, None)
+        else:
+            watermarks[key] = dict(watermark, localCount=local_count)
+    return watermarks
+
+
 def get_image(fieldValue: str) -> str:
     if not fieldValue: return ""
-    soup = BeautifulSoup(fieldValue, features="html.parser")
-    result = []
-    for img in soup.find_all('img', src=True):
-        result.append(img['src'])
-    return result[0] if result else ""
+    match = IMAGE_SRC_RE.search(fieldValue)
+    return html.unescape(next(filter(None, match.groups()), "")) if match else ""
 
 
 def get_audio(fieldValue: str) -> str:
     if not fieldValue: return ""
-    matches = re.findall(r'\[sound:(.+)]', fieldValue)
-    return matches[0] if matches else ""
+    match = SOUND_RE.search(fieldValue)
+    return match.group(1) if match else ""
 
 
-def is_image_file_missing(fieldValue: str, media_dir: str) -> bool:
-    return is_media_file_missing(fieldValue, media_dir, get_image)
+def is_image_file_missing(fieldValue: str, media_files) -> bool:
+    return is_media_file_missing(fieldValue, media_files, get_image)
 
 
-def is_audio_file_missing(fieldValue: str, media_dir: str) -> bool:
-    return is_media_file_missing(fieldValue, media_dir, get_audio)
+def is_audio_file_missing(fieldValue: str, media_files) -> bool:
+    return is_media_file_missing(fieldValue, media_files, get_audio)
 
 
-def is_media_file_missing(fieldValue: str, media_dir: str, f_get) -> bool:
+def is_media_file_missing(fieldValue: str, media_files, f_get) -> bool:
+    """:param media_files: names of the files in the media folder, e.g. an assetManager.MediaIndex"""
     filename = f_get(fieldValue)
     if not fieldValue or not filename:
         return False
-    filepath = os.path.join(media_dir, filename)
-    return not os.path.exists(filepath)
+    return filename not in media_files
 
 
 def read_words_from_file(filename: str) -> [[str]]:
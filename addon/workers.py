@@ -1,12 +1,17 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Lock, Thread
 
 import requests
-from urllib3 import Retry
 from itertools import chain
-from .misc import ThreadPool, SimpleWord
-from requests.adapters import HTTPAdapter
+from .misc import ThreadPool, SimpleWord, LoginExpired
+from .queryCache import withWordMetadata
+from .utils import normalize_term
+from .assetManager import AssetScheduler, MediaIndex, MediaStore, createDownloadSession, downloadFile
+from .queryEngine import AsyncQueryEngine, AdaptiveQueryEngine, AIMDController, ParseStage
 from .constants import VERSION, VERSION_CHECK_API
 from aqt.qt import QObject, pyqtSignal, QThread
 
@@ -58,34 +63,110 @@ class RemoteWordFetchingWorker(QObject):
     tick = pyqtSignal()
     setProgress = pyqtSignal(int)
     done = pyqtSignal()
-    doneThisGroup = pyqtSignal(list)
+    wordsPulled = pyqtSignal(list)          # words of a page
+    doneThisGroup = pyqtSignal(str)         # group name
     logger = logging.getLogger('dict2Anki.workers.RemoteWordFetchingWorker')
-
-    def __init__(self, selectedDict, selectedGroups: [tuple]):
+    MAX_WORKERS = 3
+    PREFETCH = 3    # pages in flight per group
+
+    def __init__(self, selectedDict, selectedGroups: [tuple], watermarks: dict = None):
+        """
+        :param watermarks: {groupId: {'modifiedTime', 'total'}} of the last successful sync. When every selected group
+                           has one, only words newer than it are pulled.
+        """
         super().__init__()
         self.selectedDict = selectedDict
         self.selectedGroups = selectedGroups
+        self.watermarks = watermarks or {}
+        self.incremental = False
+        self.newWatermarks = {}     # {groupId: {'modifiedTime', 'total'}} of the words pulled
+        self.loginExpired = False   # the pulled words are incomplete, and the user has to login again
+        self.incompleteGroups = []  # [(groupName, groupId)] that failed or were interrupted before their last page
 
     def run(self):
-        currentThread = QThread.currentThread()
-
-        def _pull(*args):
-            if currentThread.isInterruptionRequested():
-                return
-            wordPerPage = self.selectedDict.getWordsByPage(*args)
-            self.tick.emit()
-            return wordPerPage
+        try:
+            if self.watermarks and all(str(groupId) in self.watermarks for _, groupId in self.selectedGroups):
+                self.incremental = self._pullIncrementally()
+            if not self.incremental:
+                self._pullAll()
+        except LoginExpired as e:
+            self.logger.warning(f'登录已失效: {e}')
+            self.loginExpired = True
+        except Exception as e:
+            self.logger.exception(e)
+            self.incompleteGroups = list(self.selectedGroups)
+        self.done.emit()
 
+    def _pullIncrementally(self) -> bool:
+        """:return: False if a full pull is needed, e.g. when words were deleted from a group"""
+        self.setProgress.emit(len(self.selectedGroups))
+        pulled = []
         for groupName, groupId in self.selectedGroups:
-            totalPage = self.selectedDict.getTotalPage(groupName, groupId)
-            self.setProgress.emit(totalPage)
-            with ThreadPool(max_workers=3) as executor:
-                for i in range(totalPage):
-                    executor.submit(_pull, i, groupName, groupId)
-            remoteWordList = list(chain(*[ft for ft in executor.result]))
-            self.doneThisGroup.emit(remoteWordList)
+            watermark = self.watermarks[str(groupId)]
+            ret = self.selectedDict.getWordsSince(groupName, groupId, watermark['modifiedTime'])
+            if ret is None:
+                return False
+            words, total = ret
+            if total != watermark['total'] + len(words):
+                self.logger.info(f'单词本({groupName})有删除或修改的单词, 改为全量获取')
+                return False
+            self.newWatermarks[str(groupId)] = dict(
+                modifiedTime=max([watermark['modifiedTime']] + [w.modifiedTime for w in words]),
+                total=total,
+            )
+            pulled.append(words)
+            self.tick.emit()
+        self.logger.info(f'增量获取: {sum(len(words) for words in pulled)} 个新单词')
+        for (groupName, _), words in zip(self.selectedGroups, pulled):
+            self.wordsPulled.emit(words)
+            self.doneThisGroup.emit(groupName)
+        return True
+
+    def _pullAll(self):
+        """
+        Every group is iterated in its own thread, while the pages of all groups are fetched in one shared pool.
+        Words are emitted page by page as they arrive.
+        """
+        currentThread = QThread.currentThread()
+        self.newWatermarks = {}
+        self.incompleteGroups = []
+        progress = {'totalPages': 0}
+        lock = Lock()
+
+        def _onPageCount(totalPage):
+            with lock:
+                progress['totalPages'] += totalPage
+                self.setProgress.emit(progress['totalPages'])
+
+        def _pullGroup(groupName, groupId, executor):
+            count, latest = 0, 0
+            try:
+                for words in self.selectedDict.iterWords(groupName, groupId, self.PREFETCH, executor, _onPageCount):
+                    if currentThread.isInterruptionRequested():
+                        self.incompleteGroups.append((groupName, groupId))
+                        return
+                    count += len(words)
+                    latest = max([latest] + [w.modifiedTime for w in words])
+                    self.wordsPulled.emit(words)
+                    self.tick.emit()
+            except LoginExpired as e:
+                self.logger.warning(f'登录已失效: {e}')
+                self.loginExpired = True
+                return
+            except Exception as e:
+                self.logger.exception(f'获取单词本({groupName})失败: {e}')
+                self.incompleteGroups.append((groupName, groupId))
+                return
+            self.newWatermarks[str(groupId)] = dict(modifiedTime=latest, total=count)
+            self.doneThisGroup.emit(groupName)
 
-        self.done.emit()
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            threads = [Thread(target=_pullGroup, args=(groupName, groupId, executor), daemon=True)
+                       for groupName, groupId in self.selectedGroups]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
 
 
 class QueryWorker(QObject):
@@ -96,32 +177,102 @@ class QueryWorker(QObject):
     allQueryDone = pyqtSignal()
     logger = logging.getLogger('dict2Anki.workers.QueryWorker')
 
-    def __init__(self, wordList: [(SimpleWord, int)], api):
+    # below this many words, starting worker processes costs more than parsing in the query threads
+    PARSE_PROCESS_THRESHOLD = 200
+
+    def __init__(self, wordList: [(SimpleWord, int)], api, cache=None, engine='thread', concurrency=16, fg=None,
+                 parseProcesses=0):
+        """
+        :param fg: FieldGroup. Only enabled sections are parsed.
+        :param engine: 'thread' (ThreadPool of 3 workers), 'asyncio' (AsyncQueryEngine)
+                       or 'adaptive' (AdaptiveQueryEngine)
+        :param concurrency: max in-flight queries of the asyncio and adaptive engines
+        :param parseProcesses: parse responses in a pool of this many processes (0: parse in the query threads)
+        """
         super().__init__()
         self.wordList = wordList
         self.api = api
+        self.cache = cache
+        self.engine = engine
+        self.concurrency = concurrency
+        self.fg = fg
+        self.parseProcesses = parseProcesses
 
     def run(self):
         currentThread = QThread.currentThread()
 
+        def _onSuccess(word: SimpleWord, row, queryResult):
+            self.logger.info(f'查询成功: {word} -- {queryResult}')
+            self.thisRowDone.emit(row, queryResult)
+            self.tick.emit()
+
+        # a term listed more than once (e.g. in several groups) is queried once, and the result is sent to every row
+        rowsByTerm = {}
+
+        def _onFailure(word: SimpleWord, row):
+            for (dupWord, dupRow) in rowsByTerm.get(normalize_term(word.term), [(word, row)]):
+                self.logger.warning(f'查询失败: {dupWord}')
+                self.thisRowFailed.emit(dupRow)
+                self.tick.emit()
+
+        def _onQueried(word: SimpleWord, row, queryResult):
+            if self.cache:
+                self.cache.put(self.api.name, word, queryResult, self.fg)
+            for (dupWord, dupRow) in rowsByTerm.get(normalize_term(word.term), [(word, row)]):
+                _onSuccess(dupWord, dupRow, queryResult if dupRow == row else withWordMetadata(dict(queryResult), dupWord))
+
+        def _onParsed(word: SimpleWord, row, queryResult):
+            if queryResult:
+                _onQueried(word, row, queryResult)
+            else:
+                _onFailure(word, row)
+
         def _query(word: SimpleWord, row):
             if currentThread.isInterruptionRequested():
                 return
-            queryResult = self.api.query(word)
+            text = self.api.fetch(word)
+            if text is None:
+                _onFailure(word, row)
+                return
+            parseStage.submit(text, word).add_done_callback(lambda f: _onParsed(word, row, f.result()))
+
+        # serve cached words first, and only query the rest
+        pendingWordList = []
+        for (word, row) in self.wordList:
+            if currentThread.isInterruptionRequested():
+                break
+            queryResult = self.cache.get(self.api.name, word, self.fg) if self.cache else None
             if queryResult:
-                self.logger.info(f'查询成功: {word} -- {queryResult}')
-                self.thisRowDone.emit(row, queryResult)
+                _onSuccess(word, row, queryResult)
             else:
-                self.logger.warning(f'查询失败: {word}')
-                self.thisRowFailed.emit(row)
+                pendingWordList.append((word, row))
 
-            self.tick.emit()
-            return queryResult
+        for (word, row) in pendingWordList:
+            rowsByTerm.setdefault(normalize_term(word.term), []).append((word, row))
+        duplicates = len(pendingWordList) - len(rowsByTerm)
+        pendingWordList = [rows[0] for rows in rowsByTerm.values()]
+        flightDeduplicated = self.api.flight.deduplicated
 
-        with ThreadPool(max_workers=3) as executor:
-            for (word, row) in self.wordList:
-                executor.submit(_query, word, row)
+        processes = self.parseProcesses if len(pendingWordList) >= self.PARSE_PROCESS_THRESHOLD else 0
+        parseStage = ParseStage(self.api, self.fg, processes=processes)
+        try:
+            if self.engine == 'asyncio':
+                engine = AsyncQueryEngine(self.api, concurrency=self.concurrency, fg=self.fg, parseStage=parseStage)
+                engine.run(pendingWordList, _onQueried, _onFailure, currentThread.isInterruptionRequested)
+            elif self.engine == 'adaptive':
+                engine = AdaptiveQueryEngine(self.api, AIMDController(maximum=self.concurrency), fg=self.fg,
+                                             parseStage=parseStage)
+                engine.run(pendingWordList, _onQueried, _onFailure, currentThread.isInterruptionRequested)
+            else:
+                with ThreadPool(max_workers=3) as executor:
+                    for (word, row) in pendingWordList:
+                        executor.submit(_query, word, row)
+        finally:
+            parseStage.close()
 
+        if self.cache:
+            self.logger.info(f'查询缓存: {self.cache.stats()}')
+        self.logger.info(f'合并重复查询: 列表内 {duplicates}, 并发请求 {self.api.flight.deduplicated - flightDeduplicated}')
         self.allQueryDone.emit()
 
 
@@ -131,74 +282,209 @@ class AssetDownloadWorker(QObject):
     tick = pyqtSignal()
     done = pyqtSignal()
     logger = logging.getLogger('dict2Anki.workers.AudioDownloadWorker')
-    retries = Retry(total=5, backoff_factor=3, status_forcelist=[500, 502, 503, 504])
-    session = requests.Session()
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-
-    def __init__(self, target_dir, images: [tuple], audios: [tuple], overwrite=False, max_retry=3):
+    session = createDownloadSession()
+
+    def __init__(self, target_dir, images: [tuple], audios: [tuple], overwrite=False, max_retry=3, store: MediaStore = None,
+                 index: MediaIndex = None):
+        """
+        :param store: if given, assets are stored content-addressed, see `fileNames`
+        :param index: MediaIndex of `target_dir`, built when the worker starts if not given
+        """
         super().__init__()
         self.target_dir = target_dir
         self.images = images
         self.audios = audios
         self.overwrite = overwrite
         self.max_retry = max_retry
+        self.store = store
+        self.index = store.index if store is not None else index
+        self.fileNames = {}     # requested file name -> name of the file in the store
 
     def run(self):
         currentThread = QThread.currentThread()
-
-        def __download_with_retry(filename, url):
-            success = False
-            for i in range(self.max_retry):
-                if __download(filename, url):
-                    success = True
-                    break
-                if currentThread.isInterruptionRequested():
-                    success = False
-                    break
-                self.logger.info(f"Retrying {i+1} time...")
-            if success:
+        isInterrupted = currentThread.isInterruptionRequested
+        index = self.index if self.index is not None else MediaIndex(self.target_dir)
+
+        def _fetch(target_dir, fileName, url):
+            return self.downloadWithRetry(target_dir, fileName, url, True, self.max_retry, isInterrupted)
+
+        def _download(fileName, url):
+            if self.store is not None:
+                storedName = self.store.download(url, fileName, _fetch)
+                if storedName:
+                    self.fileNames[fileName] = storedName
+                    self.tick.emit()
+            elif self.downloadWithRetry(self.target_dir, fileName, url, self.overwrite, self.max_retry, isInterrupted, index):
                 self.tick.emit()
-            else:
-                self.logger.error(f"FAILED to download {fileName} after retrying {self.max_retry} times!")
-                self.logger.info("----------------------------------")
 
-        def __download(fileName, url) -> bool:
-            """Do NOT call this method directly. Use `__download_with_retry` instead."""
-            filepath = os.path.join(self.target_dir, fileName)
-            try:
-                if currentThread.isInterruptionRequested():
-                    return False
-                self.logger.info(f'Downloading {fileName}...')
-                # file already exists
-                if os.path.exists(filepath):
-                    if not self.overwrite:
-                        self.logger.info(f"[SKIP] {fileName} already exists")
-                        return True
-                    else:
-                        self.logger.warning(f"Overwriting file {fileName}")
-
-                r = self.session.get(url, stream=True)
-                with open(filepath, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=1024):
-                        if chunk:
-                            f.write(chunk)
-                self.logger.info(f'[OK] {fileName} 下载完成')
-                self.logger.info("----------------------------------")
+        # images and audio come from different hosts, so they download side by side
+        with AssetScheduler() as scheduler:
+            for fileName, url in chain(self.images, self.audios):
+                scheduler.submit(url, _download, fileName, url)
+        if self.store is not None:
+            self.store.save()
+            self.logger.info(f'媒体去重: {self.store.stats()}')
+        self.done.emit()
+
+    @classmethod
+    def downloadWithRetry(cls, target_dir, fileName, url, overwrite=False, max_retry=3, isInterrupted=lambda: False,
+                          index: MediaIndex = None) -> bool:
+        for i in range(max_retry):
+            if cls.download(target_dir, fileName, url, overwrite, isInterrupted, index):
                 return True
-            except Exception as e:
-                self.logger.warning(f'下载{fileName}:{url}异常: {e}')
+            if isInterrupted():
                 return False
+            cls.logger.info(f"Retrying {i+1} time...")
+        cls.logger.error(f"FAILED to download {fileName} after retrying {max_retry} times!")
+        cls.logger.info("----------------------------------")
+        return False
 
-        with ThreadPool(max_workers=3) as executor:
-            # download images
-            for fileName, url in self.images:
-                executor.submit(__download_with_retry(fileName, url))
-            # download audios
-            for fileName, url in self.audios:
-                executor.submit(__download_with_retry, fileName, url)
-        self.done.emit()
+    @classmethod
+    def download(cls, target_dir, fileName, url, overwrite=False, isInterrupted=lambda: False, index: MediaIndex = None) -> bool:
+        """
+        Download a single file. Use `downloadWithRetry` to retry on failures.
+        :param index: MediaIndex of `target_dir` to check for existing files, updated once the file is written
+        """
+        filepath = os.path.join(target_dir, fileName)
+        try:
+            if isInterrupted():
+                return False
+            cls.logger.info(f'Downloading {fileName}...')
+            # file already exists
+            exists = fileName in index if index is not None else os.path.exists(filepath)
+            if exists:
+                if not overwrite:
+                    cls.logger.info(f"[SKIP] {fileName} already exists")
+                    return True
+                else:
+                    cls.logger.warning(f"Overwriting file {fileName}")
+
+            if not downloadFile(cls.session, url, filepath, isInterrupted=isInterrupted):
+                return False
+            if index is not None:
+                index.add(fileName)
+            cls.logger.info(f'[OK] {fileName} 下载完成')
+            cls.logger.info("----------------------------------")
+            return True
+        except Exception as e:
+            cls.logger.warning(f'下载{fileName}:{url}异常: {e}')
+            return False
 
     @classmethod
     def close(cls):
         cls.session.close()
+
+
+class StreamingSyncWorker(QObject):
+    """
+    Pull, query and download as one pipeline: words of the first pages are queried, their notes written (by the GUI
+    thread, on `wordQueried`) and their assets downloaded (by an AssetScheduler) while later pages are still being
+    pulled, so a sync takes about as long as its slowest stage instead of the sum of all stages.
+    """
+    start = pyqtSignal()
+    tick = pyqtSignal()
+    wordQueried = pyqtSignal(dict, int)     # queryResult, pron_type
+    pullDone = pyqtSignal(list)             # all remote terms, for detecting deletions
+    done = pyqtSignal()
+    logger = logging.getLogger('dict2Anki.workers.StreamingSyncWorker')
+    QUEUE_SIZE = 100
+
+    def __init__(self, selectedDict, selectedGroups: [tuple], localTerms: [str], api, assetTasksFn, target_dir,
+                 cache=None, fg=None, workers=3):
+        """
+        :param localTerms: terms already in the deck, which are not queried
+        :param assetTasksFn: maps a query result to (image_task, audio_task, pron_type, is_fallback)
+        :param target_dir: media folder to download assets into
+        :param workers: number of threads of the query stage
+        """
+        super().__init__()
+        self.selectedDict = selectedDict
+        self.selectedGroups = selectedGroups
+        self.localTerms = {term.lower() for term in localTerms}
+        self.api = api
+        self.assetTasksFn = assetTasksFn
+        self.target_dir = target_dir
+        self.cache = cache
+        self.fg = fg
+        self.workers = workers
+        self.loginExpired = False   # the pull stopped early, and the user has to login again
+
+    def run(self):
+        currentThread = QThread.currentThread()
+        isInterrupted = currentThread.isInterruptionRequested
+        wordQueue = Queue(self.QUEUE_SIZE)
+        scheduler = AssetScheduler()
+        index = MediaIndex(self.target_dir)
+        seenTerms = set()
+        remoteTerms = []
+        failed = []
+        lock = Lock()
+
+        def _enqueue(words: [SimpleWord]):
+            for word in words:
+                key = word.term.lower()
+                with lock:
+                    remoteTerms.append(word.term)
+                    if key in self.localTerms or key in seenTerms:
+                        continue
+                    seenTerms.add(key)
+                wordQueue.put(word)
+
+        def _query():
+            while True:
+                word = wordQueue.get()
+                if word is None:
+                    break
+                if isInterrupted():
+                    continue
+                queryResult = self.cache.get(self.api.name, word, self.fg) if self.cache else None
+                if not queryResult:
+                    queryResult = self.api.query(word, self.fg)
+                    if queryResult and self.cache:
+                        self.cache.put(self.api.name, word, queryResult, self.fg)
+                if not queryResult:
+                    self.logger.warning(f'查询失败: {word}')
+                    failed.append(word.term)
+                    continue
+                image_task, audio_task, pron_type, _ = self.assetTasksFn(queryResult)
+                for task in (image_task, audio_task):
+                    if task:
+                        fileName, url = task
+                        scheduler.submit(url, AssetDownloadWorker.downloadWithRetry, self.target_dir, fileName, url,
+                                         isInterrupted=isInterrupted, index=index)
+                self.wordQueried.emit(queryResult, pron_type)
+                self.tick.emit()
+
+        queryThreads = [Thread(target=_query, daemon=True) for _ in range(self.workers)]
+        for thread in queryThreads:
+            thread.start()
+
+        try:
+            for groupName, groupId in self.selectedGroups:
+                if isInterrupted():
+                    break
+                for words in self.selectedDict.iterWords(groupName, groupId):
+                    if isInterrupted():
+                        break
+                    _enqueue(words)
+            self.logger.info(f'单词获取完毕: 远程 {len(remoteTerms)}, 待查 {len(seenTerms)}')
+            self.pullDone.emit(remoteTerms)
+        except LoginExpired as e:
+            # remoteTerms is incomplete: do not emit pullDone, which would offer the missing words for deletion
+            self.logger.warning(f'登录已失效: {e}')
+            self.loginExpired = True
+        except Exception as e:
+            self.logger.exception(e)
+        finally:
+            # drain the pipeline stage by stage
+            for _ in queryThreads:
+                wordQueue.put(None)
+            for thread in queryThreads:
+                thread.join()
+            scheduler.shutdown()
+
+        if failed:
+            self.logger.warning(f'查询失败({len(failed)}): {failed}')
+        if self.cache:
+            self.logger.info(f'查询缓存: {self.cache.stats()}')
+        self.done.emit()
@@ -13,7 +13,7 @@ TARGET_FILENAME = f'{WINDOW_TITLE}.zip'
 
 def create_zip(target_dir=TARGET_DIR, target_filename=TARGET_FILENAME):
     file_paths = []
-    exclude_dirs = ['build', '_image', 'test', 'test_addon', 'testapi', '__pycache__', '.git', '.idea', '.pytest_cache', 'screenshots', 'venv']
+    exclude_dirs = ['build', 'user_files', '_image', 'test', 'test_addon', 'testapi', '__pycache__', '.git', '.idea', '.pytest_cache', 'screenshots', 'venv']
     exclude_files = ['README.md', 'SUPPORT.md', 'Makefile', 'Makefile.bat', 'apitest.py', 'constants_tests.py', 'words.txt', 'NOTE.txt',
                      'test.py', 'testqt.py', 'apitest_eudict.py', 'apitest_youdao.py', 'FixQtEnums.py',
                      '.gitignore', '.travis.yml', 'deploy.py', 'requirements.txt', '.DS_Store', 'meta.json']
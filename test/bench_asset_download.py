@@ -0,0 +1,104 @@
+# Benchmark: the old asset download loops vs AssetScheduler, against a local server posing as an image and an audio host
+# ('localhost' and '127.0.0.1'). The server records how many images and audio files are in flight at the same time.
+# Run from the repo root: python -m test.bench_asset_download
+import logging
+import os
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+import requests
+
+from addon.assetManager import AssetScheduler
+from addon.misc import ThreadPool
+
+LATENCY = 0.05      # seconds per file
+WORD_COUNT = 200    # one image and one audio file per word
+BODY = b'\0' * 20000
+inflight = {'image': 0, 'audio': 0}
+overlap = 0         # most images and audio files downloading at the same time: min(images, audio)
+lock = Lock()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        global overlap
+        kind = 'image' if self.path.startswith('/image') else 'audio'
+        with lock:
+            inflight[kind] += 1
+            overlap = max(overlap, min(inflight.values()))
+        time.sleep(LATENCY)
+        with lock:
+            inflight[kind] -= 1
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=16))
+
+
+def download(target_dir, fileName, url):
+    r = session.get(url, stream=True, timeout=10)
+    with open(os.path.join(target_dir, fileName), 'wb') as f:
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            f.write(chunk)
+
+
+def images_inline(target_dir, images, audios):
+    """AssetDownloadWorker.run before it was fixed: images ran in the worker thread, only audio used the pool"""
+    with ThreadPool(max_workers=3) as executor:
+        for fileName, url in images:
+            download(target_dir, fileName, url)
+        for fileName, url in audios:
+            executor.submit(download, target_dir, fileName, url)
+
+
+def thread_pool(target_dir, images, audios):
+    with ThreadPool(max_workers=3) as executor:
+        for fileName, url in images + audios:
+            executor.submit(download, target_dir, fileName, url)
+
+
+def scheduler(target_dir, images, audios):
+    with AssetScheduler(maxWorkers=8, hostLimits={'localhost': 4, '127.0.0.1': 4}) as s:
+        for fileName, url in images + audios:
+            s.submit(url, download, target_dir, fileName, url)
+
+
+def bench(name, fn, images, audios):
+    global overlap
+    overlap = 0
+    with tempfile.TemporaryDirectory() as target_dir:
+        start = time.perf_counter()
+        fn(target_dir, images, audios)
+        elapsed = time.perf_counter() - start
+        count = len(os.listdir(target_dir))
+    print(f'{name:<36} {count} files  {elapsed:6.2f}s  images and audio in flight together: {overlap}')
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 64
+    Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    images = [(f'MG-word{i}.jpg', f'http://localhost:{port}/image/{i}') for i in range(WORD_COUNT)]
+    audios = [(f'MG-word{i}.mp3', f'http://127.0.0.1:{port}/audio/{i}') for i in range(WORD_COUNT)]
+
+    print(f'{WORD_COUNT} images + {WORD_COUNT} audio files, {LATENCY * 1000:.0f}ms latency')
+    bench('images inline, audio ThreadPool(3)', images_inline, images, audios)
+    bench('ThreadPool(3)', thread_pool, images, audios)
+    bench('AssetScheduler(8, 4 per host)', scheduler, images, audios)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
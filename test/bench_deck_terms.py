@@ -0,0 +1,110 @@
+# Benchmark: loading note by note vs the bulk term index, on a synthetic collection with a large Dict2Anki deck.
+# The collection is a bare sqlite database with Anki's notes/cards tables, so that it runs without Anki installed.
+# Run from the repo root: python -m test.bench_deck_terms
+import json
+import sqlite3
+import sys
+import time
+import types
+from collections import namedtuple
+
+from addon.constants import MODEL_FIELDS
+
+NOTE_COUNT = 30000
+OTHER_NOTE_COUNT = 20000    # notes of other note types / decks, which must not be picked up
+DICT2ANKI_MID, OTHER_MID = 1, 2
+DECK_ID, SUB_DECK_ID, OTHER_DECK_ID = 10, 11, 20
+NotetypeNameId = namedtuple('NotetypeNameId', 'name id')
+
+
+def createCollection() -> sqlite3.Connection:
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER NOT NULL, flds TEXT NOT NULL)')
+    db.execute('CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER NOT NULL, did INTEGER NOT NULL, '
+               'odid INTEGER NOT NULL DEFAULT 0)')
+    db.execute('CREATE INDEX ix_cards_nid ON cards (nid)')
+    filler = ['<div>some field content</div>'] * (len(MODEL_FIELDS) - 1)
+    notes, cards = [], []
+    for i in range(NOTE_COUNT + OTHER_NOTE_COUNT):
+        mid = DICT2ANKI_MID if i < NOTE_COUNT or i % 2 else OTHER_MID
+        did = (DECK_ID if i % 3 else SUB_DECK_ID) if i < NOTE_COUNT else OTHER_DECK_ID
+        notes.append((i, mid, '\x1f'.join([f'Word{i}'] + filler)))
+        cards.extend([(2 * i, i, did), (2 * i + 1, i, did)])      # normal and backwards cards
+    db.executemany('INSERT INTO notes VALUES (?, ?, ?)', notes)
+    db.executemany('INSERT INTO cards (id, nid, did) VALUES (?, ?, ?)', cards)
+    return db
+
+
+class Note:
+    """Loaded the way Collection.get_note does: one row, split into fields, plus its note type"""
+
+    def __init__(self, col, nid):
+        mid, flds = col.db.execute('SELECT mid, flds FROM notes WHERE id = ?', (nid,)).fetchone()
+        self.notetype = json.loads(col.notetypes[mid])
+        self.fields = dict(zip([f['name'] for f in self.notetype['flds']], flds.split('\x1f')))
+
+    def model(self):
+        return self.notetype
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+
+def createMainWindow(db: sqlite3.Connection):
+    def notetype(mid, name):
+        return json.dumps({'id': mid, 'name': name, 'flds': [{'name': f, 'ord': i} for i, f in enumerate(MODEL_FIELDS)]})
+
+    wrapper = types.SimpleNamespace(all=lambda sql, *args: db.execute(sql, args).fetchall(), execute=db.execute)
+    col = types.SimpleNamespace(db=wrapper, notetypes={DICT2ANKI_MID: notetype(DICT2ANKI_MID, 'Dict2Anki 3.0'),
+                                                       OTHER_MID: notetype(OTHER_MID, 'Basic')})
+    col.decks = types.SimpleNamespace(
+        id_for_name=lambda name: DECK_ID,
+        deck_and_child_ids=lambda did: [DECK_ID, SUB_DECK_ID],
+    )
+    col.models = types.SimpleNamespace(
+        all_names_and_ids=lambda: [NotetypeNameId(json.loads(v)['name'], k) for k, v in col.notetypes.items()],
+        get=lambda mid: json.loads(col.notetypes[mid]),
+        field_map=lambda nt: {f['name']: (f['ord'], f) for f in nt['flds']},
+    )
+    col.findNotes = lambda query: [nid for nid, in db.execute(
+        'SELECT DISTINCT nid FROM cards WHERE did IN (?, ?) OR odid IN (?, ?)', (DECK_ID, SUB_DECK_ID) * 2)]
+    col.getNote = lambda nid: Note(col, nid)
+    return types.SimpleNamespace(col=col)
+
+
+def getWordsNoteByNote(mw, deckName) -> [str]:
+    """getWordsByDeck before the bulk index"""
+    notes = mw.col.findNotes(f'deck:"{deckName}"')
+    words = []
+    for nid in notes:
+        note = mw.col.getNote(nid)
+        if note.model().get('name', '').lower().startswith('dict2anki') and note['term']:
+            words.append(note['term'])
+    return words
+
+
+def main():
+    db = createCollection()
+    mw = createMainWindow(db)
+    anki = types.ModuleType('anki')
+    anki.utils = types.ModuleType('anki.utils')
+    anki.utils.ids2str = lambda ids: '(' + ','.join(str(i) for i in ids) + ')'
+    anki.collection = types.ModuleType('anki.collection')
+    anki.collection.AddNoteRequest = anki.collection.OpChanges = None
+    aqt = types.ModuleType('aqt')
+    aqt.mw = mw
+    sys.modules.update({'aqt': aqt, 'anki': anki, 'anki.utils': anki.utils, 'anki.collection': anki.collection})
+    from addon import noteManager
+
+    print(f'{NOTE_COUNT} Dict2Anki notes in the deck, {OTHER_NOTE_COUNT} other notes in the collection')
+    start = time.perf_counter()
+    before = getWordsNoteByNote(mw, 'deck')
+    print(f'{"note by note":<16} {len(before)} terms  {time.perf_counter() - start:6.2f}s')
+    start = time.perf_counter()
+    after = noteManager.getWordsByDeck('deck')
+    print(f'{"bulk index":<16} {len(after)} terms  {time.perf_counter() - start:6.2f}s')
+    assert sorted(before) == sorted(after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Benchmark: finding Dict2Anki notes with missing assets note by note vs findTermsWithMissingAssets,
+# on a synthetic collection (a bare sqlite notes table) and a media folder of empty files.
+# Run from the repo root: python -m test.bench_missing_assets
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+
+from bs4 import BeautifulSoup
+
+from addon.constants import MODEL_FIELDS, MODEL_NAME
+
+NOTE_COUNT = 50000
+MISSING_EVERY = 20      # every n-th note misses its audio file
+MID = 1
+
+
+def createCollection(mediaDir) -> sqlite3.Connection:
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER NOT NULL, flds TEXT NOT NULL)')
+    notes = []
+    for i in range(NOTE_COUNT):
+        fields = dict.fromkeys(MODEL_FIELDS, '<div>some field content</div>')
+        fields.update(term=f'word{i}', image=f'<div><img src="MG-word{i}.jpg" /></div>', pronunciation=f'[sound:MG-word{i}.mp3]')
+        notes.append((i, MID, '\x1f'.join(fields[name] for name in MODEL_FIELDS)))
+        open(os.path.join(mediaDir, f'MG-word{i}.jpg'), 'wb').close()
+        if i % MISSING_EVERY:
+            open(os.path.join(mediaDir, f'MG-word{i}.mp3'), 'wb').close()
+    db.executemany('INSERT INTO notes VALUES (?, ?, ?)', notes)
+    return db
+
+
+class Note:
+    def __init__(self, db, nid):
+        flds, = db.execute('SELECT flds FROM notes WHERE id = ?', (nid,)).fetchone()
+        self.fields = dict(zip(MODEL_FIELDS, flds.split('\x1f')))
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+
+def createMainWindow(db, mediaDir):
+    model = {'id': MID, 'name': MODEL_NAME, 'flds': [{'name': f, 'ord': i} for i, f in enumerate(MODEL_FIELDS)]}
+    col = types.SimpleNamespace(
+        db=types.SimpleNamespace(all=lambda sql, *args: db.execute(sql, args).fetchall()),
+        models=types.SimpleNamespace(byName=lambda name: model,
+                                     field_map=lambda nt: {f['name']: (f['ord'], f) for f in nt['flds']}),
+        media=types.SimpleNamespace(dir=lambda: mediaDir),
+        findNotes=lambda query: [nid for nid, in db.execute('SELECT id FROM notes WHERE mid = ?', (MID,))],
+        getNote=lambda nid: Note(db, nid),
+    )
+    return types.SimpleNamespace(col=col)
+
+
+def scanNoteByNote(mw) -> [str]:
+    """on_btnDownloadMissingAssets_clicked before the scanner, with the soup based utils.get_image of that time"""
+    def get_image(fieldValue):
+        soup = BeautifulSoup(fieldValue, features="html.parser")
+        result = [img['src'] for img in soup.find_all('img', src=True)]
+        return result[0] if result else ""
+
+    def get_audio(fieldValue):
+        matches = re.findall(r'\[sound:(.+)]', fieldValue)
+        return matches[0] if matches else ""
+
+    def missing(fieldValue, media_dir, f_get):
+        filename = f_get(fieldValue)
+        return bool(fieldValue and filename) and not os.path.exists(os.path.join(media_dir, filename))
+
+    terms = []
+    for noteId in mw.col.findNotes(f"note:{MODEL_NAME}"):
+        note = mw.col.getNote(noteId)
+        media_dir = mw.col.media.dir()
+        if missing(note['image'], media_dir, get_image) or missing(note['pronunciation'], media_dir, get_audio):
+            terms.append(note['term'])
+    return terms
+
+
+def main():
+    with tempfile.TemporaryDirectory() as mediaDir:
+        db = createCollection(mediaDir)
+        mw = createMainWindow(db, mediaDir)
+        anki = types.ModuleType('anki')
+        anki.utils = types.ModuleType('anki.utils')
+        anki.collection = types.ModuleType('anki.collection')
+        anki.collection.AddNoteRequest = anki.collection.OpChanges = None
+        aqt = types.ModuleType('aqt')
+        aqt.mw = mw
+        sys.modules.update({'aqt': aqt, 'anki': anki, 'anki.utils': anki.utils, 'anki.collection': anki.collection})
+        from addon import noteManager
+        from addon.assetManager import MediaIndex
+
+        print(f'{NOTE_COUNT} notes, {len(os.listdir(mediaDir))} media files')
+        start = time.perf_counter()
+        before = scanNoteByNote(mw)
+        print(f'{"note by note":<28} {len(before)} missing  {time.perf_counter() - start:6.2f}s')
+        start = time.perf_counter()
+        after = noteManager.findTermsWithMissingAssets(MediaIndex(mediaDir))
+        print(f'{"findTermsWithMissingAssets":<28} {len(after)} missing  {time.perf_counter() - start:6.2f}s')
+        assert before == [term for term, _, _ in after]
+
+
+if __name__ == '__main__':
+    main()
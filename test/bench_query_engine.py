@@ -0,0 +1,86 @@
+# Benchmark: ThreadPool(3) vs AsyncQueryEngine vs AdaptiveQueryEngine against a local mock Youdao server.
+# Run from the repo root: python -m test.bench_query_engine
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from addon import queryEngine
+from addon.misc import SimpleWord, ThreadPool
+from addon.queryApi.youdao import API
+from addon.queryEngine import AsyncQueryEngine, AdaptiveQueryEngine, AIMDController
+
+LATENCY = 0.05      # seconds per request, simulating the network round trip
+WORD_COUNT = 300
+with open('testapi/yd_words_query.response.json', 'rb') as f:
+    RESPONSE = f.read()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockAPI(API):
+    pass
+
+
+def bench(name, fn, words):
+    start = time.perf_counter()
+    done = fn(words)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28} {done}/{len(words)} words  {elapsed:6.2f}s  {len(words) / elapsed:8.1f} words/s')
+
+
+def thread_pool(words):
+    with ThreadPool(max_workers=3) as executor:
+        for word, row in words:
+            executor.submit(MockAPI.query, word)
+    return len(executor.result)
+
+
+def async_engine(concurrency):
+    def run(words):
+        results = []
+        engine = AsyncQueryEngine(MockAPI, concurrency=concurrency)
+        engine.run(words, lambda word, row, result: results.append(result), lambda word, row: None)
+        return len(results)
+    return run
+
+
+def adaptive_engine(maximum):
+    def run(words):
+        results = []
+        engine = AdaptiveQueryEngine(MockAPI, AIMDController(maximum=maximum))
+        engine.run(words, lambda word, row, result: results.append(result), lambda word, row: None)
+        return len(results)
+    return run
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    Thread(target=server.serve_forever, daemon=True).start()
+    MockAPI.url = f'http://127.0.0.1:{server.server_port}/jsonapi'
+
+    words = [(SimpleWord(f'word{i}'), i) for i in range(WORD_COUNT)]
+    print(f'{WORD_COUNT} words, {LATENCY * 1000:.0f}ms latency, aiohttp={"yes" if queryEngine.aiohttp else "no"}')
+    bench('ThreadPool(max_workers=3)', thread_pool, words)
+    for concurrency in (3, 16, 64):
+        bench(f'AsyncQueryEngine({concurrency})', async_engine(concurrency), words)
+    bench('AdaptiveQueryEngine(max=64)', adaptive_engine(64), words)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
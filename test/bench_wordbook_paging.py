@@ -0,0 +1,72 @@
+# Benchmark: fixed 15-word pages vs auto-tuned page size, pulling a wordbook from a local mock Youdao endpoint.
+# Run from the repo root: python -m test.bench_wordbook_paging
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+
+from addon.dictionary.youdao import Youdao
+from addon.misc import ThreadPool
+
+LATENCY = 0.03      # seconds per request
+WORD_COUNT = 10000
+MAX_LIMIT = 500     # the mock server caps pages at this size
+ITEMS = [dict(itemId=str(i), bookId='0', bookName='无标签', word=f'word{i}', trans='n. 单词', phonetic='',
+              modifiedTime=1500000000000 + i) for i in range(WORD_COUNT)]
+requestCount = 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        global requestCount
+        requestCount += 1
+        time.sleep(LATENCY)
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        offset, limit = int(query['offset']), min(int(query['limit']), MAX_LIMIT)
+        body = json.dumps({'code': 0, 'msg': 'SUCCESS', 'data': {'total': WORD_COUNT, 'itemList': ITEMS[offset:offset + limit]}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def pull(pageSize):
+    """Same request pattern as RemoteWordFetchingWorker"""
+    global requestCount
+    requestCount = 0
+    Youdao.pageSize = pageSize
+    youdao = Youdao()
+    start = time.perf_counter()
+    firstPage, totalPage = youdao.getFirstPage('无标签', '0')
+    with ThreadPool(max_workers=3) as executor:
+        for i in range(1, totalPage):
+            executor.submit(youdao.getWordsByPage, i, '无标签', '0')
+    words = firstPage + list(chain(*executor.result))
+    elapsed = time.perf_counter() - start
+    assert len({w.term for w in words}) == WORD_COUNT
+    name = f'pageSize={pageSize}' if pageSize else f'auto (-> {Youdao.pageSize})'
+    print(f'{name:<20} {requestCount:5d} requests  {elapsed:6.2f}s')
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    Youdao.wordsUrl = f'http://127.0.0.1:{server.server_port}/wordbook/webapi/words'
+
+    print(f'{WORD_COUNT} words, {LATENCY * 1000:.0f}ms latency, server caps pages at {MAX_LIMIT}')
+    pull(Youdao.DEFAULT_PAGE_SIZE)
+    pull(None)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -29,3 +29,19 @@ def tooltip(*args, **kwargs):
 
 def openLink(*args, **kwargs):
     pass
+
+
+class CollectionOp:
+    def __init__(self, parent, op):
+        self._op = op
+        self._success = lambda changes: None
+
+    def success(self, success):
+        self._success = success
+        return self
+
+    def failure(self, failure):
+        return self
+
+    def run_in_background(self, *args, **kwargs):
+        self._success(self._op(mw.col))
@@ -24,3 +24,19 @@ def getWordsByDeck(*args, **kwargs):
 
 def getNotes(*args, **kwargs):
     return []
+
+
+def buildNote(*args, **kwargs):
+    return None, False
+
+
+def fillMissingValues(*args, **kwargs):
+    return [], 0
+
+
+def writeNotes(newNotes, updatedNotes, *args, **kwargs):
+    return len(newNotes), len(updatedNotes), None
+
+
+def findTermsWithMissingAssets(*args, **kwargs):
+    return []
@@ -0,0 +1,225 @@
+import gc
+import os
+import time
+import weakref
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+import pytest
+import requests
+
+from ..addon.assetManager import AssetScheduler, MediaIndex, MediaStore, createDownloadSession, downloadFile, partPathOf
+
+
+class InflightCounter:
+    def __init__(self):
+        self.lock = Lock()
+        self.inflight = defaultdict(int)
+        self.peak = defaultdict(int)
+
+    def download(self, host):
+        with self.lock:
+            self.inflight[host] += 1
+            self.inflight['*'] += 1
+            for key in (host, '*'):
+                self.peak[key] = max(self.peak[key], self.inflight[key])
+        time.sleep(0.02)
+        with self.lock:
+            self.inflight[host] -= 1
+            self.inflight['*'] -= 1
+        return host
+
+
+def test_host_limits_and_global_cap():
+    counter = InflightCounter()
+    hosts = {'a.example.com': 'http://a.example.com/x', 'cdn.b.net': 'https://cdn.b.net/y', 'c.org': 'http://c.org/z'}
+    with AssetScheduler(maxWorkers=5, hostLimits={'example.com': 1, 'b.net': 3}, defaultHostLimit=2) as scheduler:
+        futures = [scheduler.submit(url, counter.download, host) for _ in range(10) for host, url in hosts.items()]
+    assert [f.result() for f in futures] == [host for _ in range(10) for host in hosts]
+    assert counter.peak['a.example.com'] == 1
+    assert counter.peak['cdn.b.net'] == 3
+    assert counter.peak['c.org'] == 2
+    assert counter.peak['*'] == 5
+
+
+def test_failed_download_frees_its_host_slot():
+    def fail():
+        raise ValueError('broken')
+
+    with AssetScheduler(maxWorkers=2, hostLimits={'a.com': 1}) as scheduler:
+        failed = scheduler.submit('http://a.com/1', fail)
+        ok = scheduler.submit('http://a.com/2', lambda: 'ok')
+    assert isinstance(failed.exception(), ValueError)
+    assert ok.result() == 'ok'
+
+
+def test_submit_blocks_at_max_pending():
+    release = Event()
+    submitted = []
+
+    def produce(scheduler):
+        for i in range(10):
+            scheduler.submit(f'http://host{i}.com/x', release.wait, 5)
+            submitted.append(i)
+
+    with AssetScheduler(maxWorkers=8, maxPending=3) as scheduler:
+        producer = Thread(target=produce, args=(scheduler,))
+        producer.start()
+        time.sleep(0.2)
+        assert len(submitted) == 3
+        release.set()
+        producer.join(5)
+    assert len(submitted) == 10
+
+
+def test_done_downloads_are_not_kept():
+    with AssetScheduler(maxWorkers=2) as scheduler:
+        future = weakref.ref(scheduler.submit('http://a.com/1', lambda: 'ok'))
+        scheduler.join()
+        gc.collect()
+        assert future() is None
+
+
+def make_fetch(contents: dict, fetched: list):
+    """fetch function of MediaStore.download, serving `contents` by url"""
+    def fetch(target_dir, fileName, url):
+        fetched.append(url)
+        with open(os.path.join(target_dir, fileName), 'wb') as f:
+            f.write(contents[url])
+        return True
+    return fetch
+
+
+def test_media_store_deduplicates_by_url_and_content(tmp_path):
+    mediaDir, manifest = str(tmp_path / 'media'), str(tmp_path / 'user_files' / 'manifest.json')
+    os.makedirs(mediaDir)
+    fetched = []
+    fetch = make_fetch({'http://a/1': b'same' * 100, 'http://b/2': b'same' * 100, 'http://a/3': b'other'}, fetched)
+
+    store = MediaStore(mediaDir, manifest)
+    first = store.download('http://a/1', 'MG-apple.mp3', fetch)
+    assert store.download('http://b/2', 'MG-Apple.mp3', fetch) == first       # same content
+    assert store.download('http://a/1', 'MG-apples.mp3', fetch) == first      # same url: not downloaded again
+    other = store.download('http://a/3', 'MG-pear.mp3', fetch)
+    assert other != first and first.startswith('MG-') and first.endswith('.mp3')
+    assert fetched == ['http://a/1', 'http://b/2', 'http://a/3']
+    assert sorted(os.listdir(mediaDir)) == sorted([first, other])
+    assert store.reused == 2 and store.bytesSaved == 800
+    store.save()
+
+    fetched.clear()
+    store = MediaStore(mediaDir, manifest)
+    assert store.download('http://b/2', 'MG-x.mp3', fetch) == first
+    assert fetched == []
+
+
+def test_media_index(tmp_path):
+    for name in ('MG-apple.jpg', 'MG-apple.mp3', 'other.jpg'):
+        (tmp_path / name).write_bytes(b'x')
+    index = MediaIndex(str(tmp_path))
+    assert len(index) == 2
+    assert 'MG-apple.jpg' in index and 'MG-pear.jpg' not in index
+    assert 'other.jpg' in index and 'missing.jpg' not in index      # checked on disk
+    index.add('MG-pear.jpg')
+    assert 'MG-pear.jpg' in index
+
+
+BODY = bytes(range(256)) * 800     # 200 KiB
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves BODY with Range support. The first `drops` responses are cut off after `dropAfter` bytes."""
+    drops = 0
+    dropAfter = 50000
+    honorRange = True
+    stall = 0
+    headerStall = 0
+    ranges = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.ranges.append(self.headers.get('Range'))
+        time.sleep(cls.headerStall)
+        start = 0
+        if self.headers.get('Range') and cls.honorRange:
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(BODY) - 1}/{len(BODY)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        time.sleep(cls.stall)
+        if cls.drops > 0:
+            cls.drops -= 1
+            self.wfile.write(BODY[start:start + cls.dropAfter])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(BODY[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FlakyHandler.drops, FlakyHandler.honorRange, FlakyHandler.stall, FlakyHandler.headerStall = 0, True, 0, 0
+    FlakyHandler.ranges = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    httpd.daemon_threads = True
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}/MG-apple.mp3'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_dropped_download_is_resumed(server, tmp_path):
+    FlakyHandler.drops = 1
+    filepath = str(tmp_path / 'MG-apple.mp3')
+    with requests.Session() as session:
+        with pytest.raises((IOError, requests.RequestException)):
+            downloadFile(session, server, filepath, chunkSize=4096)
+        assert not os.path.exists(filepath)     # never a truncated file under the final name
+        partSize = os.path.getsize(partPathOf(filepath))
+        assert 0 < partSize < len(BODY)
+
+        assert downloadFile(session, server, filepath, chunkSize=4096)
+    assert FlakyHandler.ranges == [None, f'bytes={partSize}-']
+    assert open(filepath, 'rb').read() == BODY
+    assert not os.path.exists(partPathOf(filepath))
+
+
+def test_download_restarts_when_range_is_ignored(server, tmp_path):
+    FlakyHandler.drops, FlakyHandler.honorRange = 1, False
+    filepath = str(tmp_path / 'MG-apple.mp3')
+    with requests.Session() as session:
+        with pytest.raises((IOError, requests.RequestException)):
+            downloadFile(session, server, filepath)
+        assert downloadFile(session, server, filepath)
+    assert open(filepath, 'rb').read() == BODY
+
+
+def test_download_read_timeout(server, tmp_path):
+    FlakyHandler.stall = 2
+    filepath = str(tmp_path / 'MG-apple.mp3')
+    start = time.monotonic()
+    with requests.Session() as session:
+        with pytest.raises(requests.RequestException):
+            downloadFile(session, server, filepath, timeout=(1, 0.2))
+    assert time.monotonic() - start < 1.5
+    assert not os.path.exists(filepath)
+
+
+@pytest.mark.parametrize('stall', ['headerStall', 'stall'])
+def test_download_session_gives_up_on_stalled_host(server, tmp_path, stall):
+    """the session of the download workers must not retry reads of a stalled host"""
+    setattr(FlakyHandler, stall, 2)
+    filepath = str(tmp_path / 'MG-apple.mp3')
+    start = time.monotonic()
+    with createDownloadSession() as session:
+        with pytest.raises(requests.RequestException):
+            downloadFile(session, server, filepath, timeout=(1, 0.2))
+    assert time.monotonic() - start < 1.5
+    assert len(FlakyHandler.ranges) == 1
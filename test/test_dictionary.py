@@ -0,0 +1,158 @@
+import pytest
+
+from ..addon.dictionary.youdao import Youdao
+from ..addon.misc import AbstractDictionary, LoginExpired
+
+
+class FakeResponse:
+    status_code = 200
+    url = 'http://dict.youdao.com/wordbook/webapi/words'
+
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'code': 0, 'data': self.data}
+
+
+class FakeWordbook:
+    """Serves the wordbook pages of `items`, newest first when sorted by time"""
+
+    def __init__(self, items, sortByTime=True, maxLimit=None):
+        self.items = sorted(items, key=lambda item: -item['modifiedTime']) if sortByTime else items
+        self.maxLimit = maxLimit
+        self.requests = 0
+
+    def get(self, url, timeout=None, params=None):
+        self.requests += 1
+        offset, limit = params['offset'], min(params['limit'], self.maxLimit or params['limit'])
+        return FakeResponse({'total': len(self.items), 'itemList': self.items[offset:offset + limit]})
+
+
+def make_items(count):
+    return [dict(word=f'word{i}', trans='', modifiedTime=1000 + i, bookId='0', bookName='无标签') for i in range(count)]
+
+
+def test_youdao_words_since_watermark(monkeypatch):
+    wordbook = FakeWordbook(make_items(20000))
+    monkeypatch.setattr(Youdao, 'session', wordbook)
+    words, total = Youdao().getWordsSince('无标签', '0', 1000 + 19995)
+    assert [w.term for w in words] == ['word19999', 'word19998', 'word19997', 'word19996']
+    assert total == 20000
+    assert wordbook.requests == 1
+
+
+def test_youdao_words_since_requires_time_order(monkeypatch):
+    monkeypatch.setattr(Youdao, 'session', FakeWordbook(make_items(30), sortByTime=False))
+    assert Youdao().getWordsSince('无标签', '0', 1010) is None
+
+
+def test_youdao_pages_with_capped_page_size(monkeypatch):
+    # a book smaller than the cap does not prove a page size, so the larger book probes again and finds the cap
+    monkeypatch.setattr(Youdao, 'pageSize', None)
+    small = FakeWordbook(make_items(250), maxLimit=400)
+    monkeypatch.setattr(Youdao, 'session', small)
+    youdao = Youdao()
+    words, totalPage = youdao.getFirstPage('small', '1')
+    assert (len(words), totalPage) == (250, 1)
+    assert small.requests == 1
+    assert Youdao.pageSize is None
+    monkeypatch.setattr(Youdao, 'session', FakeWordbook(make_items(2500), maxLimit=400))
+    assert youdao.getTotalPage('large', '2') == 7
+    assert Youdao.pageSize == 400
+    words = [w.term for page in range(7) for w in youdao.getWordsByPage(page, 'large', '2')]
+    assert sorted(words) == sorted(f'word{i}' for i in range(2500))
+
+
+def test_youdao_probe_is_the_first_page(monkeypatch):
+    monkeypatch.setattr(Youdao, 'pageSize', None)
+    wordbook = FakeWordbook(make_items(2500))
+    monkeypatch.setattr(Youdao, 'session', wordbook)
+    words, totalPage = Youdao().getFirstPage('无标签', '0')
+    assert (len(words), totalPage) == (1000, 3)
+    assert wordbook.requests == 1
+    assert Youdao.pageSize == 1000
+
+
+def test_youdao_probe_login_expired(monkeypatch):
+    monkeypatch.setattr(Youdao, 'pageSize', None)
+    monkeypatch.setattr(Youdao, 'session', ExpiringWordbook([], expireFrom=0))
+    monkeypatch.setattr(AbstractDictionary, '_verifiedCookies', {})
+    with pytest.raises(LoginExpired):
+        Youdao().getFirstPage('无标签', '0')
+    assert Youdao.pageSize is None
+
+
+def test_youdao_first_page_carries_page_count(monkeypatch):
+    wordbook = FakeWordbook(make_items(100))
+    monkeypatch.setattr(Youdao, 'pageSize', 15)
+    monkeypatch.setattr(Youdao, 'session', wordbook)
+    words, totalPage = Youdao().getFirstPage('无标签', '0')
+    assert len(words) == 15
+    assert totalPage == 7
+    assert wordbook.requests == 1
+
+
+def test_youdao_iter_words_yields_pages_in_order(monkeypatch):
+    monkeypatch.setattr(Youdao, 'pageSize', 15)
+    monkeypatch.setattr(Youdao, 'session', FakeWordbook(make_items(100)))
+    pageCounts = []
+    batches = list(Youdao().iterWords('无标签', '0', prefetch=2, onPageCount=pageCounts.append))
+    assert pageCounts == [7]
+    assert [len(batch) for batch in batches] == [15] * 6 + [10]
+    assert [w.term for batch in batches for w in batch] == [f'word{i}' for i in range(99, -1, -1)]
+
+
+class ExpiringWordbook(FakeWordbook):
+    """The login expires from the page at offset `expireFrom` on"""
+
+    def __init__(self, items, expireFrom=1):
+        super().__init__(items)
+        self.expireFrom = expireFrom
+
+    def get(self, url, timeout=None, params=None):
+        if params['offset'] >= self.expireFrom:
+            self.requests += 1
+            rsp = FakeResponse(None)
+            rsp.status_code = 401
+            return rsp
+        return super().get(url, timeout, params)
+
+
+def test_youdao_login_expired_on_later_page(monkeypatch):
+    monkeypatch.setattr(Youdao, 'pageSize', 15)
+    monkeypatch.setattr(Youdao, 'session', ExpiringWordbook(make_items(100)))
+    monkeypatch.setattr(AbstractDictionary, '_verifiedCookies', {})
+    batches = Youdao().iterWords('无标签', '0', prefetch=2)
+    assert len(next(batches)) == 15
+    with pytest.raises(LoginExpired):
+        next(batches)
+    with pytest.raises(LoginExpired):
+        Youdao().getWordsByPage(1, '无标签', '0')
+
+
+class FakeAccountInfo:
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, cookies=None, timeout=None):
+        self.requests += 1
+        return FakeResponse({'user': 'dict2anki'})
+
+
+def test_login_state_is_cached_per_cookie(monkeypatch):
+    accountInfo = FakeAccountInfo()
+    monkeypatch.setattr(Youdao, 'session', accountInfo)
+    monkeypatch.setattr(AbstractDictionary, '_verifiedCookies', {})
+    youdao = Youdao()
+    assert youdao.checkLoginState({'DICT_SESS': 'a'})
+    assert youdao.checkLoginState({'DICT_SESS': 'a'})
+    assert accountInfo.requests == 1
+    assert youdao.checkLoginState({'DICT_SESS': 'b'})
+    assert accountInfo.requests == 2
+    youdao.forgetLoginState()
+    assert youdao.checkLoginState({'DICT_SESS': 'a'})
+    assert accountInfo.requests == 3
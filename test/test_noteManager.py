@@ -0,0 +1,203 @@
+import importlib
+import sqlite3
+import sys
+import types
+from collections import namedtuple
+
+import pytest
+
+from ..addon.constants import MODEL_FIELDS, MODEL_NAME
+
+DICT2ANKI_MID, OTHER_MID = 1, 2
+DECK_ID, OTHER_DECK_ID = 10, 20
+AddNoteRequest = namedtuple('AddNoteRequest', 'note deck_id')
+
+
+class FakeCollection:
+    """The parts of anki.collection.Collection that noteManager uses, over a bare sqlite database with notes/cards"""
+
+    def __init__(self):
+        self.sql = sqlite3.connect(':memory:')
+        self.sql.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER NOT NULL, flds TEXT NOT NULL)')
+        self.sql.execute('CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER NOT NULL, did INTEGER NOT NULL, '
+                         'odid INTEGER NOT NULL DEFAULT 0)')
+        self.db = types.SimpleNamespace(all=lambda sql, *args: self.sql.execute(sql, args).fetchall())
+        notetypes = {DICT2ANKI_MID: self.notetype(DICT2ANKI_MID, MODEL_NAME), OTHER_MID: self.notetype(OTHER_MID, 'Basic')}
+        self.decks = types.SimpleNamespace(id_for_name=lambda name: DECK_ID, deck_and_child_ids=lambda did: [did])
+        self.models = types.SimpleNamespace(
+            all_names_and_ids=lambda: [types.SimpleNamespace(name=nt['name'], id=mid) for mid, nt in notetypes.items()],
+            get=notetypes.get,
+            byName=lambda name: next((nt for nt in notetypes.values() if nt['name'] == name), None),
+            field_map=lambda nt: {f['name']: (f['ord'], f) for f in nt['flds']},
+        )
+        self.writes = []        # (method, notes) of each write
+        self.undoEntries = []
+
+    def add_custom_undo_entry(self, name):
+        self.undoEntries.append(name)
+        return len(self.undoEntries)
+
+    def add_notes(self, requests):
+        self.writes.append(('add_notes', [(r.note, r.deck_id) for r in requests]))
+
+    def update_notes(self, notes):
+        self.writes.append(('update_notes', list(notes)))
+
+    def merge_undo_entries(self, target):
+        assert target == len(self.undoEntries)
+        return f'changes of {self.undoEntries[-1]}'
+
+    @staticmethod
+    def notetype(mid, name):
+        return {'id': mid, 'name': name, 'flds': [{'name': f, 'ord': i} for i, f in enumerate(MODEL_FIELDS)]}
+
+    def addNote(self, nid, did=DECK_ID, mid=DICT2ANKI_MID, **fields):
+        flds = '\x1f'.join(fields.get(name, '') for name in MODEL_FIELDS)
+        self.sql.execute('INSERT INTO notes VALUES (?, ?, ?)', (nid, mid, flds))
+        self.sql.execute('INSERT INTO cards (nid, did) VALUES (?, ?)', (nid, did))
+
+
+@pytest.fixture
+def noteManager(monkeypatch):
+    """addon.noteManager imported against fake aqt/anki modules, with a FakeCollection"""
+    anki = types.ModuleType('anki')
+    anki.utils = types.ModuleType('anki.utils')
+    anki.utils.ids2str = lambda ids: '(' + ','.join(str(i) for i in ids) + ')'
+    anki.notes = types.ModuleType('anki.notes')
+    anki.notes.Note = lambda col, model: dict.fromkeys(MODEL_FIELDS, '')
+    anki.collection = types.ModuleType('anki.collection')
+    anki.collection.AddNoteRequest = AddNoteRequest
+    anki.collection.OpChanges = lambda: 'no changes'
+    aqt = types.ModuleType('aqt')
+    aqt.mw = types.SimpleNamespace(col=FakeCollection())
+    for name, module in {'aqt': aqt, 'anki': anki, 'anki.utils': anki.utils, 'anki.notes': anki.notes,
+                         'anki.collection': anki.collection}.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    name = f'{__package__.rpartition(".")[0]}.addon.noteManager'
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    return importlib.import_module(name)
+
+
+def test_missing_assets_are_the_referenced_filenames(noteManager):
+    col = noteManager.mw.col
+    col.addNote(1, term='apple', image='<div><img src="MG-0123456789abcdef.jpg" /></div>',
+                pronunciation='[sound:MG-fedcba9876543210.mp3]')
+    col.addNote(2, term='pear', image='<div><img src="MG-pear.jpg" /></div>', pronunciation='[sound:MG-pear.mp3]')
+    col.addNote(3, term='plum', image='', pronunciation='[sound:MG-plum.mp3]')
+    col.addNote(4, mid=OTHER_MID, term='fig', pronunciation='[sound:MG-fig.mp3]')
+    mediaFiles = {'MG-pear.jpg', 'MG-pear.mp3', 'MG-fedcba9876543210.mp3'}
+    assert noteManager.findTermsWithMissingAssets(mediaFiles) == [
+        ('apple', 'MG-0123456789abcdef.jpg', ''),
+        ('plum', '', 'MG-plum.mp3'),
+    ]
+
+
+def test_write_notes_in_chunks(noteManager):
+    col = noteManager.mw.col
+    progress = []
+    added, updated, changes = noteManager.writeNotes([(f'new{i}', DECK_ID) for i in range(5)], ['old0', 'old1', 'old2'],
+                                                     undoName='Sync', chunkSize=2, onProgress=lambda *p: progress.append(p))
+    assert (added, updated, changes) == (5, 3, 'changes of Sync')
+    assert col.undoEntries == ['Sync']
+    assert col.writes == [
+        ('add_notes', [('new0', DECK_ID), ('new1', DECK_ID)]),
+        ('add_notes', [('new2', DECK_ID), ('new3', DECK_ID)]),
+        ('add_notes', [('new4', DECK_ID)]),
+        ('update_notes', ['old0', 'old1']),
+        ('update_notes', ['old2']),
+    ]
+    assert progress == [(2, 8), (4, 8), (5, 8), (7, 8), (8, 8)]
+
+
+def test_write_notes_cancelled(noteManager):
+    col = noteManager.mw.col
+    progress = []
+    added, updated, changes = noteManager.writeNotes([(f'new{i}', DECK_ID) for i in range(5)], ['old0'], chunkSize=2,
+                                                     onProgress=lambda *p: progress.append(p),
+                                                     isCancelled=lambda: len(progress) == 2)
+    assert (added, updated, changes) == (4, 0, 'changes of Dict2Anki')
+    assert [method for method, notes in col.writes] == ['add_notes', 'add_notes']
+
+
+def test_write_notes_cancelled_before_first_chunk(noteManager):
+    added, updated, changes = noteManager.writeNotes([('new0', DECK_ID)], ['old0'], isCancelled=lambda: True)
+    assert (added, updated, changes) == (0, 0, 'no changes')
+    assert noteManager.mw.col.writes == []
+
+
+def test_write_no_notes(noteManager):
+    assert noteManager.writeNotes([], []) == (0, 0, 'no changes')
+    assert noteManager.mw.col.undoEntries == []
+
+
+def make_word(term='apple', **kwargs):
+    word = dict(term=term, bookName='无标签', exam_type=['CET4'], modifiedTime=1000, BrEPhonetic='ˈæpl',
+                AmEPhonetic='ˈæpl', definition_brief='n. 苹果', definition=['n. 苹果'], definition_en=['a round fruit'],
+                image='http://example.com/apple.jpg', phrase=[('apple pie', '苹果派')],
+                sentence=[('an <b>apple</b> a day', '一天一个苹果', 'http://example.com/s0.mp3')],
+                BrEPron='http://example.com/uk.mp3', AmEPron='http://example.com/us.mp3')
+    word.update(kwargs)
+    return word
+
+
+def test_set_note_field_value(noteManager):
+    note = {'term': 'apple', 'definition': ''}
+    assert not noteManager.setNoteFieldValue(note, 'term', 'apple', isNewNote=False, overwrite=True)
+    assert not noteManager.setNoteFieldValue(note, 'term', 'Apple', isNewNote=False, overwrite=False)
+    assert not noteManager.setNoteFieldValue(note, 'definition', '', isNewNote=False, overwrite=True)
+    assert note == {'term': 'apple', 'definition': ''}
+    assert noteManager.setNoteFieldValue(note, 'definition', 'n. 苹果', isNewNote=False, overwrite=False)
+    assert noteManager.setNoteFieldValue(note, 'term', 'Apple', isNewNote=False, overwrite=True)
+    assert note == {'term': 'Apple', 'definition': 'n. 苹果'}
+
+
+def test_build_note_modified_flag(noteManager):
+    config = {'briefDefinition': True}
+    deck, model = {'id': DECK_ID}, FakeCollection.notetype(DICT2ANKI_MID, MODEL_NAME)
+    note, modified = noteManager.buildNote(deck, model, config, make_word(), 'AmEPron')
+    assert modified and note['term'] == 'apple' and note['pronunciation'] == '[sound:MG-apple.mp3]'
+    assert noteManager.buildNote(deck, model, config, None, 'AmEPron') == (None, False)
+
+    # filling or overwriting an up-to-date note changes nothing, so it is skipped
+    for overwrite in (False, True):
+        assert noteManager.buildNote(deck, model, config, make_word(), 'AmEPron', note, overwrite) == (note, False)
+
+    existing = dict(note, definition_en='')
+    assert noteManager.buildNote(deck, model, config, make_word(), 'AmEPron', existing) == (existing, True)
+    assert existing == note
+    # a changed query result only counts as a modification when it is written
+    word = make_word(definition_brief='n. 苹果；苹果树')
+    assert noteManager.buildNote(deck, model, config, word, 'AmEPron', dict(note)) == (note, False)
+    updated, modified = noteManager.buildNote(deck, model, config, word, 'AmEPron', dict(note), overwrite=True)
+    assert modified and updated['definition'] == 'n. 苹果；苹果树'
+
+
+def test_fill_missing_values_skips_unchanged_notes(noteManager):
+    config = {'briefDefinition': True}
+    deck, model = {'id': DECK_ID}, FakeCollection.notetype(DICT2ANKI_MID, MODEL_NAME)
+    words = [make_word(f'word{i}') for i in range(4)]
+    notes = [noteManager.buildNote(deck, model, config, word, 'AmEPron')[0] for word in words]
+    notes[1]['image'] = ''
+    notes[3]['phrase0'] = ''
+    updatedNotes, skipped = noteManager.fillMissingValues(config, [(word, 'AmEPron', note) for word, note in zip(words, notes)]
+                                                          + [(None, 'AmEPron', {})])
+    assert updatedNotes == [notes[1], notes[3]] and notes[1]['image'] and notes[3]['phrase0']
+    assert skipped == 2
+
+
+def test_note_ids_of_words(noteManager):
+    col = noteManager.mw.col
+    col.addNote(1, term='Apple')
+    col.addNote(2, term='apple')
+    col.addNote(3, term='pear')
+    col.addNote(4, term='pear')                     # duplicate note of the same term
+    col.addNote(5, term='plum', did=OTHER_DECK_ID)
+    col.addNote(6, term='kiwi', mid=OTHER_MID)
+    assert noteManager.getNoteIDsOfWords(['apple'], 'deck') == [2]
+    assert noteManager.getNoteIDsOfWords(['Apple'], 'deck') == [1]
+    assert noteManager.getNoteIDsOfWords(['Apple', 'apple', 'APPLE'], 'deck') == [1, 2]
+    assert noteManager.getNoteIDsOfWords(['APPLE'], 'deck') in ([1], [2])
+    assert noteManager.getNoteIDsOfWords(['Pear'], 'deck') in ([3], [4])
+    assert sorted(noteManager.getNoteIDsOfWords(['pear', 'pear'], 'deck')) == [3, 4]
+    assert noteManager.getNoteIDsOfWords(['plum', 'kiwi', 'fig'], 'deck') == []
+    assert sorted(noteManager.getWordsByDeck('deck')) == ['Apple', 'apple', 'pear', 'pear']
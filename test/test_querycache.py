@@ -0,0 +1,64 @@
+import time
+
+from ..addon.constants import FieldGroup
+from ..addon.misc import SimpleWord
+from ..addon.queryCache import QueryCache
+
+
+def make_result(term):
+    return {
+        'term': term, 'bookId': 0, 'bookName': '', 'modifiedTime': 0, 'definition_brief': '',
+        'definition': [f'definition of {term}'], 'image': None,
+    }
+
+
+def test_hit_overlays_word_metadata(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache.db'))
+    cache.put('api', SimpleWord('apple'), make_result('apple'))
+    result = cache.get('api', SimpleWord(' apple ', trans='n. 苹果', bookName='book'))
+    assert result['definition'] == ['definition of apple']
+    assert result['term'] == ' apple '
+    assert result['definition_brief'] == 'n. 苹果'
+    assert result['bookName'] == 'book'
+    assert cache.get('other api', SimpleWord('apple')) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_empty_results_are_not_cached(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache.db'))
+    cache.put('api', SimpleWord('apple'), dict(make_result('apple'), definition=[]))
+    assert cache.get('api', SimpleWord('apple')) is None
+
+
+def test_ttl_and_bypass(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache.db'), ttl=60)
+    cache.put('api', SimpleWord('apple'), make_result('apple'))
+    cache.bypass = True
+    assert cache.get('api', SimpleWord('apple')) is None
+    cache.bypass = False
+    assert cache.get('api', SimpleWord('apple')) is not None
+    cache.ttl = -1
+    assert cache.get('api', SimpleWord('apple')) is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache.db'), max_entries=50)
+    for i in range(99):
+        cache.put('api', SimpleWord(f'w{i}'), make_result(f'w{i}'))
+    time.sleep(0.01)
+    cache.get('api', SimpleWord('w0'))     # w0 becomes the most recently used
+    cache.put('api', SimpleWord('w99'), make_result('w99'))     # 100th put triggers eviction
+    count = cache._conn.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+    assert count == 50
+    assert cache.get('api', SimpleWord('w0')) is not None
+    assert cache.get('api', SimpleWord('w1')) is None
+    assert cache.get('api', SimpleWord('w99')) is not None
+
+
+def test_entries_missing_enabled_sections_are_misses(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache.db'))
+    fg = FieldGroup()
+    fg.toggleOff('image')
+    cache.put('api', SimpleWord('apple'), make_result('apple'), fg)
+    assert cache.get('api', SimpleWord('apple'), fg) is not None
+    assert cache.get('api', SimpleWord('apple')) is None
@@ -0,0 +1,192 @@
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from urllib.parse import parse_qs, quote, urlparse
+
+import pytest
+import requests
+
+from ..addon import queryEngine
+from ..addon.misc import AbstractQueryAPI, SimpleWord, SingleFlight
+from ..addon.queryApi import youdao
+from ..addon.queryEngine import AIMDController, AdaptiveQueryEngine, AsyncQueryEngine, ParseStage
+
+TESTAPI_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'testapi')
+
+
+def test_additive_increase_up_to_maximum():
+    controller = AIMDController(initial=2, maximum=4)
+    for _ in range(20):
+        controller.acquire()
+        controller.release(0.1, ok=True)
+    assert controller.limit == 4
+
+
+def test_multiplicative_decrease_on_errors():
+    controller = AIMDController(initial=8, maximum=16, cooldown=0)
+    controller.acquire()
+    controller.release(0.1, ok=False)
+    assert controller.limit == 4
+    for _ in range(5):
+        controller.acquire()
+        controller.release(0.1, ok=False)
+    assert controller.limit == 1
+    assert controller.errors == 6
+
+
+def test_decrease_once_per_cooldown():
+    controller = AIMDController(initial=8, maximum=16, cooldown=60)
+    for _ in range(3):
+        controller.acquire()
+        controller.release(0.1, ok=False)
+    assert controller.limit == 4
+
+
+def test_decrease_on_rising_p95():
+    controller = AIMDController(initial=8, maximum=8, window=10, cooldown=0)
+    for _ in range(10):
+        controller.acquire()
+        controller.release(0.1, ok=True)
+    assert controller.limit == 8
+    controller.acquire()
+    controller.release(1.0, ok=True)
+    assert controller.limit == 4
+
+
+def test_parse_stage_in_processes_matches_inline():
+    with open(os.path.join(TESTAPI_DIR, 'yd_words_query.response.json'), encoding='utf8') as f:
+        text = f.read()
+    words = [SimpleWord('abandon', trans=str(i)) for i in range(8)]
+    inline = ParseStage(youdao.API)
+    pooled = ParseStage(youdao.API, processes=2)
+    try:
+        futures = [pooled.submit(text, word) for word in words]
+        futures.append(pooled.submit('not json', SimpleWord('broken')))
+        assert [f.result() for f in futures[:-1]] == [inline.submit(text, word).result() for word in words]
+        assert futures[-1].result() is None
+    finally:
+        pooled.close()
+
+
+def test_single_flight_shares_in_flight_call():
+    flight = SingleFlight()
+    calls = []
+    release = Event()
+
+    def fetch(term):
+        calls.append(term)
+        release.wait(5)
+        return f'<{term}>'
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [executor.submit(flight.do, 'flower', fetch, 'flower') for _ in range(5)]
+        other = executor.submit(flight.do, 'tree', fetch, 'tree')
+        while flight.deduplicated < 4:
+            time.sleep(0.01)
+        release.set()
+    assert [f.result() for f in futures] == ['<flower>'] * 5
+    assert other.result() == '<tree>'
+    assert sorted(calls) == ['flower', 'tree']
+    assert flight.deduplicated == 4
+    # finished calls are not reused
+    assert flight.do('flower', fetch, 'flower') == '<flower>'
+    assert len(calls) == 3
+
+
+class SlowQueryHandler(BaseHTTPRequestHandler):
+    """Answers queries of `slowTerm` only once `flight` has coalesced `followers` concurrent queries of it"""
+    hits = Counter()
+    lock = Lock()
+    flight = None
+    slowTerm, followers = 'flower', 0
+
+    def do_GET(self):
+        term = parse_qs(urlparse(self.path).query)['q'][0]
+        with self.lock:
+            self.hits[term] += 1
+        deadline = time.monotonic() + 5
+        while term == self.slowTerm and self.flight.deduplicated < self.followers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        body = json.dumps({'term': term}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalAPI(AbstractQueryAPI):
+    name = 'local'
+    timeout = 10
+    baseUrl = None
+    session = requests.Session()
+
+    @classmethod
+    def query(cls, word: SimpleWord, fg=None) -> dict:
+        return cls.parseResponse(cls.fetch(word), word, fg)
+
+    @classmethod
+    def buildRequest(cls, word: SimpleWord) -> str:
+        return f'{cls.baseUrl}/?q={quote(word.term.strip())}'
+
+    @classmethod
+    def parseResponse(cls, text: str, word: SimpleWord, fg=None) -> dict:
+        return json.loads(text)
+
+    @classmethod
+    def close(cls):
+        pass
+
+
+@pytest.fixture
+def api():
+    flight = SingleFlight()
+    SlowQueryHandler.hits, SlowQueryHandler.flight = Counter(), flight
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SlowQueryHandler)
+    httpd.daemon_threads = True
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    yield type('LocalAPI', (LocalAPI,), dict(flight=flight, baseUrl=f'http://127.0.0.1:{httpd.server_port}'))
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def runThreadEngine(api, wordList, onSuccess, onFailure):
+    """the 'thread' engine of QueryWorker: api.fetch in a pool of threads"""
+    def _query(word, row):
+        text = api.fetch(word)
+        if text is None:
+            onFailure(word, row)
+        else:
+            onSuccess(word, row, api.parseResponse(text, word))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for word, row in wordList:
+            executor.submit(_query, word, row)
+
+
+@pytest.mark.parametrize('engine', ['thread', 'asyncio', 'asyncio-executor', 'adaptive'])
+def test_engines_coalesce_concurrent_queries(api, engine, monkeypatch):
+    terms = ['flower', ' flower', 'flower ', 'flower  ', '  flower', 'tree']
+    wordList = [(SimpleWord(term), row) for row, term in enumerate(terms)]
+    SlowQueryHandler.followers = 4
+    results, failures = {}, []
+    onSuccess = lambda word, row, queryResult: results.__setitem__(row, queryResult['term'])
+    onFailure = lambda word, row: failures.append(row)
+    if engine == 'thread':
+        runThreadEngine(api, wordList, onSuccess, onFailure)
+    elif engine == 'adaptive':
+        AdaptiveQueryEngine(api, AIMDController(maximum=8)).run(wordList, onSuccess, onFailure)
+    else:
+        if engine == 'asyncio-executor':
+            monkeypatch.setattr(queryEngine, 'aiohttp', None)
+        AsyncQueryEngine(api, concurrency=8).run(wordList, onSuccess, onFailure)
+    assert not failures
+    assert results == {row: term.strip() for row, term in enumerate(terms)}
+    assert SlowQueryHandler.hits == {'flower': 1, 'tree': 1}
+    assert api.flight.deduplicated == 4
@@ -0,0 +1,36 @@
+from ..addon import utils
+
+
+def test_get_image():
+    assert utils.get_image('<div><img src="MG-chloride.jpg" /></div>') == 'MG-chloride.jpg'
+    assert utils.get_image("<IMG alt=x SRC='a&amp;b.jpg'>") == 'a&b.jpg'
+    assert utils.get_image('<img data-src="lazy.jpg" src=plain.jpg>') == 'plain.jpg'
+    assert utils.get_image('<img>') == ''
+    assert utils.get_image('') == ''
+    assert utils.get_image(None) == ''
+
+
+def test_get_audio():
+    assert utils.get_audio('[sound:MG-chloride.mp3]') == 'MG-chloride.mp3'
+    assert utils.get_audio('[sound:a.mp3] [sound:b.mp3]') == 'a.mp3'
+    assert utils.get_audio('[sound:]') == ''
+    assert utils.get_audio(None) == ''
+
+
+def test_is_media_file_missing():
+    media = {'MG-apple.jpg'}
+    assert not utils.is_image_file_missing('<img src="MG-apple.jpg">', media)
+    assert utils.is_image_file_missing('<img src="MG-pear.jpg">', media)
+    assert not utils.is_audio_file_missing('', media)
+
+
+def test_merge_watermarks():
+    stored = {'yd/deck/1': dict(modifiedTime=1, total=1, localCount=1), 'yd/deck/9': dict(modifiedTime=9, total=9, localCount=9)}
+    pending = {'yd/deck/1': dict(modifiedTime=5, total=3)}
+    assert utils.merge_watermarks(stored, pending, 3, 0) == {
+        'yd/deck/1': dict(modifiedTime=5, total=3, localCount=3),
+        'yd/deck/9': dict(modifiedTime=9, total=9, localCount=9),
+    }
+    # kept deletion candidates: the next pull of the group is a full one, which offers them again
+    assert utils.merge_watermarks(stored, pending, 5, 2) == {'yd/deck/9': dict(modifiedTime=9, total=9, localCount=9)}
+    assert stored['yd/deck/1'] == dict(modifiedTime=1, total=1, localCount=1)
@@ -0,0 +1,89 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+from ..addon.misc import SimpleWord
+
+
+class Signal:
+    """pyqtSignal without Qt: slots are called directly on emit"""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj.__dict__.setdefault(f'_signal_{self.name}', BoundSignal())
+
+
+class BoundSignal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+
+class FakeThread:
+    @staticmethod
+    def currentThread():
+        return FakeThread()
+
+    def isInterruptionRequested(self):
+        return False
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """addon.workers imported against a fake aqt.qt"""
+    qt = types.ModuleType('aqt.qt')
+    qt.QObject = type('QObject', (), {})
+    qt.pyqtSignal = lambda *types: Signal()
+    qt.QThread = FakeThread
+    aqt = types.ModuleType('aqt')
+    aqt.qt = qt
+    monkeypatch.setitem(sys.modules, 'aqt', aqt)
+    monkeypatch.setitem(sys.modules, 'aqt.qt', qt)
+    name = f'{__package__.rpartition(".")[0]}.addon.workers'
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    return importlib.import_module(name)
+
+
+class FakeDictionary:
+    """Two pages per group. The pages of the groups in `failing` raise on the first page"""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+
+    def iterWords(self, groupName, groupId, prefetch, executor, onPageCount):
+        if groupName in self.failing:
+            raise ConnectionError(f'{groupName} unreachable')
+        onPageCount(2)
+        for page in range(2):
+            yield [SimpleWord(f'{groupName}{page}', modifiedTime=1000 + page)]
+
+
+def test_pull_records_failed_groups(workers):
+    worker = workers.RemoteWordFetchingWorker(FakeDictionary(failing=('b',)), [('a', 1), ('b', 2)])
+    pulled, done = [], []
+    worker.wordsPulled.connect(lambda words: pulled.extend(w.term for w in words))
+    worker.done.connect(lambda: done.append(True))
+    worker.run()
+    assert done and not worker.loginExpired
+    assert sorted(pulled) == ['a0', 'a1']
+    assert worker.incompleteGroups == [('b', 2)]
+    assert worker.newWatermarks == {'1': dict(modifiedTime=1001, total=2)}
+
+
+def test_pull_all_groups(workers):
+    worker = workers.RemoteWordFetchingWorker(FakeDictionary(), [('a', 1), ('b', 2)])
+    worker.run()
+    assert worker.incompleteGroups == []
+    assert set(worker.newWatermarks) == {'1', '2'}